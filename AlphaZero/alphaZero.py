@@ -1,13 +1,18 @@
 import numpy as np
 import math
 import random
+import time
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.multiprocessing as mp
 import os
+from collections import OrderedDict
 from tqdm import trange
 import pickle
 
+from AlphaZero.inference_server import InferenceServer
+
 
 class ResNet(nn.Module):
     '''
@@ -64,6 +69,26 @@ class ResNet(nn.Module):
         policy = self.policyHead(x)
         value = self.valueHead(x)
         return policy, value
+
+    @staticmethod
+    def convert_policy_head(state_dict, actions):
+        '''
+        ## Description:
+            Converts the weights of a model to a new action encoding by keeping, for every new action, the row of the
+            policy head of the matching old action. Actions without a match (`-1`) start from zero.
+            ## Parameters:
+            - `state_dict`: The weights of the model trained with the old encoding.
+            - `actions`: The old action of every new action.
+            ## Returns:
+            - `state_dict`: The weights for a model with the new encoding.
+            '''
+        state_dict = dict(state_dict)
+        actions = torch.as_tensor(actions)
+        for name in ['policyHead.4.weight', 'policyHead.4.bias']:
+            converted = state_dict[name][actions.clamp(min=0)].clone()
+            converted[actions < 0] = 0
+            state_dict[name] = converted
+        return state_dict
         
 class ResBlock(nn.Module):
     '''
@@ -86,143 +111,765 @@ class ResBlock(nn.Module):
         x = F.relu(x)
         return x
 
-class Node:
+class SearchTree:
     '''
-    # Alpha Zero Node
+    # Search Tree
     ## Description:
-        A node for the AlphaZero MCTS. It contains the state, the action taken to get to the state, the prior probability of the action, the visit count, the value sum, and the children of the node.
-    ## Metohds:
-        - `is_expanded()`: Returns whether the node has been expanded.
-        - `select()`: Selects the best child node based on the UCB.
-        - `get_ucb()`: Returns the UCB of a child node.
-        - `expand()`: Expands the node by adding children.
-        - `backpropagate()`: Backpropagates the value of the node to the parent node.
-        '''
-    def __init__(self, game, args, state, player, parent=None, action_taken=None, prior=0, visit_count=0):
+        The MCTS tree stored as a structure of arrays. Node `i` is described by the `i`-th entry of every array: the action taken to get to it, the player to move, the prior probability of the action, the visit count, the value sum, its parent and its children.
+        The children of a node are added together, so they are stored next to each other from `first_child` to `first_child + num_children`, and selection is a vectorized argmax over that slice.
+        The arrays are preallocated and doubled when they run out of space. The tree does not hold boards: the MCTS plays the actions on a single working board on the way down and undoes them on the way back up.
+    ## Methods:
+        - `add_root()`: Adds the root node.
+        - `is_expanded()`: Returns whether a node has been expanded.
+        - `select()`: Selects the child of a node with the best UCB.
+        - `expand()`: Expands a node by adding its children.
+        - `backpropagate()`: Backpropagates a value from a node to the root.
+        - `get_action_probs()`: Returns the visit count distribution of the children of a node.
+        - `extract()`: Copies the subtree under a node into a new tree rooted at it.
+        '''
+    def __init__(self, game, args, capacity=4096):
         self.game = game
         self.args = args
-        self.state = state
-        self.parent = parent
-        self.action_taken = action_taken
-        self.player = player
-        self.prior = prior
-        self.children = []
-        
-        self.visit_count = visit_count
-        self.value_sum = 0
-        
-    def is_expanded(self):
+        self.size = 0
+
+        self.action_taken = np.full(capacity, -1, dtype=np.int64)
+        self.player = np.zeros(capacity, dtype=np.int8)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.visit_count = np.zeros(capacity, dtype=np.int64)
+        self.value_sum = np.zeros(capacity, dtype=np.float64)
+        self.q_value = np.zeros(capacity, dtype=np.float64)
+        self.parent = np.full(capacity, -1, dtype=np.int64)
+        self.first_child = np.zeros(capacity, dtype=np.int64)
+        self.num_children = np.zeros(capacity, dtype=np.int64)
+        self.hash = np.zeros(capacity, dtype=np.uint64)
+
+    def reserve(self, count):
+        '''
+        # reserve
+        ## Description:
+            Makes sure there is space for `count` more nodes, doubling the arrays as many times as needed.
+        '''
+        capacity = len(self.visit_count)
+        if self.size + count <= capacity:
+            return
+        while self.size + count > capacity:
+            capacity *= 2
+        for name in ['action_taken', 'player', 'prior', 'visit_count', 'value_sum', 'q_value', 'parent', 'first_child', 'num_children', 'hash']:
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+    def add_root(self, player, visit_count=1):
+        self.reserve(1)
+        root = self.size
+        self.action_taken[root] = -1
+        self.player[root] = player
+        self.prior[root] = 0
+        self.visit_count[root] = visit_count
+        self.value_sum[root] = 0
+        self.q_value[root] = 0
+        self.parent[root] = -1
+        self.num_children[root] = 0
+        self.size += 1
+        return root
+
+    def is_expanded(self, node):
         '''
         # is_expanded
         ## Description:
             Returns whether the node has been expanded.
         ## Returns:
             - `bool`: Whether the node has been expanded.'''
-        return len(self.children) > 0
-    
-    def select(self):
-        best_child = []
-        best_ucb = -np.inf
-        
-        for child in self.children:
-            ucb = self.get_ucb(child)
-            if ucb > best_ucb:
-                best_child = [child]
-                best_ucb = ucb
-            elif ucb == best_ucb:
-                best_child.append(child)
-                
-        return best_child[0] if len(best_child) == 1 else random.choice(best_child)
-    
-    def get_ucb(self, child):
-        if child.visit_count == 0:
-            q_value = 0
-        else:
-            q_value = 1 - ((child.value_sum / child.visit_count) + 1) / 2
-        return q_value + self.args['C'] * (math.sqrt(self.visit_count) / (child.visit_count + 1)) * child.prior
-    
-    def expand(self, policy):
-        for action, prob in enumerate(policy):
-            if prob > 0:
-                child_state = self.state.copy()
-                child_state = self.game.get_next_state(child_state, action, 1)
-                child_state = self.game.change_perspective(child_state, player=-1)
-                child = Node(self.game, self.args, child_state, self.game.get_opponent(self.player), self, action, prob)
-                self.children.append(child)
-            
-    def backpropagate(self, value):
-        self.value_sum += value
-        self.visit_count += 1
-        
-        if self.parent is not None:
+        return self.num_children[node] > 0
+
+    def children(self, node):
+        start = self.first_child[node]
+        return slice(start, start + self.num_children[node])
+
+    def get_ucb(self, node):
+        '''
+        # get_ucb
+        ## Description:
+            Returns the UCB of every child of a node at once. The Q value of each child, seen from the node, is kept up to date by backpropagate().
+        '''
+        children = self.children(node)
+        return self.q_value[children] + (self.args['C'] * math.sqrt(self.visit_count[node])) * self.prior[children] / (self.visit_count[children] + 1)
+
+    def select(self, node):
+        ucb = self.get_ucb(node)
+        best_child = np.flatnonzero(ucb == ucb.max())
+        best_child = best_child[0] if len(best_child) == 1 else random.choice(best_child)
+        return self.first_child[node] + best_child
+
+    def expand(self, node, policy):
+        actions = np.flatnonzero(policy > 0)
+        self.reserve(len(actions))
+
+        children = slice(self.size, self.size + len(actions))
+        self.action_taken[children] = actions
+        self.player[children] = self.game.get_opponent(self.player[node])
+        self.prior[children] = policy[actions]
+        self.visit_count[children] = 0
+        self.value_sum[children] = 0
+        self.q_value[children] = 0
+        self.parent[children] = node
+        self.num_children[children] = 0
+
+        self.first_child[node] = self.size
+        self.num_children[node] = len(actions)
+        self.size += len(actions)
+
+    def add_virtual_loss(self, node, virtual_loss):
+        '''
+        # add_virtual_loss
+        ## Description:
+            Counts `virtual_loss` pending visits, each one lost for the player choosing the node, on the path from the node to the root.
+            This steers the next selections away from a leaf that is waiting for the network. A negative amount takes them back.
+        '''
+        while node != -1:
+            self.value_sum[node] += virtual_loss
+            self.visit_count[node] += virtual_loss
+            if self.visit_count[node] > 0:
+                self.q_value[node] = 1 - ((self.value_sum[node] / self.visit_count[node]) + 1) / 2
+            else:
+                self.q_value[node] = 0
+            node = self.parent[node]
+
+    def backpropagate(self, node, value):
+        while node != -1:
+            self.value_sum[node] += value
+            self.visit_count[node] += 1
+            self.q_value[node] = 1 - ((self.value_sum[node] / self.visit_count[node]) + 1) / 2
             value = self.game.get_opponent_value(value)
-            self.parent.backpropagate(value)  
+            node = self.parent[node]
+
+    def get_action_probs(self, node):
+        children = self.children(node)
+        action_probs = np.zeros(self.game.action_size)
+        action_probs[self.action_taken[children]] = self.visit_count[children]
+        if np.sum(action_probs) == 0:
+            # no simulation reached the children yet, fall back to their priors
+            action_probs[self.action_taken[children]] = self.prior[children]
+        action_probs /= np.sum(action_probs)
+        return action_probs
+
+    def extract(self, node, depth=None):
+        '''
+        # extract
+        ## Description:
+            Copies the subtree under a node into a new tree where the node is the root, keeping all its statistics.
+            The nodes are copied level by level, so the children of every node stay contiguous and the rest of the
+            old tree is left behind. With `depth`, only the nodes up to that many levels below the node are copied,
+            and the deepest ones become leaves again.
+        ## Returns:
+            - `tree`: The new tree, with the node at index 0.
+        '''
+        levels = [np.array([node])]
+        while depth is None or len(levels) <= depth:
+            expanded = levels[-1][self.num_children[levels[-1]] > 0]
+            if len(expanded) == 0:
+                break
+            levels.append(np.concatenate([np.arange(self.first_child[n], self.first_child[n] + self.num_children[n]) for n in expanded]))
+        nodes = np.concatenate(levels)
+
+        tree = SearchTree(self.game, self.args, capacity=len(nodes))
+        for name in ['action_taken', 'player', 'prior', 'visit_count', 'value_sum', 'q_value', 'num_children', 'hash']:
+            getattr(tree, name)[:len(nodes)] = getattr(self, name)[nodes]
+        if depth is not None and len(levels) > depth:
+            tree.num_children[len(nodes) - len(levels[-1]):len(nodes)] = 0
+
+        new_index = np.full(self.size, -1, dtype=np.int64)
+        new_index[nodes] = np.arange(len(nodes))
+        tree.parent[:len(nodes)] = new_index[self.parent[nodes]]
+        tree.parent[0] = -1
+        tree.first_child[:len(nodes)] = np.where(tree.num_children[:len(nodes)] > 0, new_index[self.first_child[nodes]], 0)
+        tree.size = len(nodes)
+        return tree
+
+class EvaluationCache:
+    '''
+    # Evaluation Cache
+    ## Description:
+        A bounded cache of network evaluations, keyed by the Zobrist hash of the board seen from the perspective of the
+        player to move (see get_hash() of the game), so that repeated positions (the opening of every game, transpositions)
+        skip the forward pass. For Go the key is canonicalized under the 8 symmetries of the board: the board is stored
+        in the orientation with the smallest hash, and the policy is turned back to the orientation of the board on a hit.
+        The least recently used entry is evicted once the cache holds `capacity` entries.
+    ## Methods:
+        - `get()`: Returns the cached policy and value of a board, or None.
+        - `put()`: Stores the policy and value of a board.
+        - `clear()`: Empties the cache, e.g. after the model has been trained.
+        '''
+    def __init__(self, game, args, capacity=100000):
+        self.game = game
+        self.args = args
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # symmetries[k] lists, for every point of the k-th transformed board, the point of the original board it comes from
+        points = np.arange(game.row_count * game.column_count).reshape(game.row_count, game.column_count)
+        if args['game'] == 'Go':
+            transforms = [np.rot90(points, k) for k in range(4)] + [np.rot90(np.fliplr(points), k) for k in range(4)]
+        else:
+            transforms = [points]
+        self.symmetries = np.stack([transform.flatten() for transform in transforms])
+
+    def canonicalize(self, board):
+        '''
+        # canonicalize
+        ## Description:
+            Finds the symmetry of the board with the smallest Zobrist hash, hashing all the transformed boards at once
+            with the keys of the game (the pieces of the player to move are 1 in the neutral board).
+        ## Returns:
+            - `key`: The hash of the canonical board.
+            - `symmetry`: The index of the symmetry that turns the board into the canonical board.
+        '''
+        boards = board.reshape(-1)[self.symmetries]
+        keys = np.bitwise_xor.reduce(self.game.zobrist[0] * (boards == 1) ^ self.game.zobrist[1] * (boards == -1), axis=1)
+        symmetry = int(np.argmin(keys))
+        return int(keys[symmetry]), symmetry
+
+    def get(self, board):
+        key, symmetry = self.canonicalize(board)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+
+        policy, value = entry
+        points = self.symmetries[symmetry]
+        original = policy.copy()
+        original[points] = policy[:len(points)]
+        return original, value
+
+    def put(self, board, policy, value):
+        key, symmetry = self.canonicalize(board)
+        points = self.symmetries[symmetry]
+        canonical = policy.copy()
+        canonical[:len(points)] = policy[points]
+        self.entries[key] = (canonical, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+class OpeningCache:
+    '''
+    # Opening Cache
+    ## Description:
+        Keeps the root of the search trees of the positions reached in the first `args['opening_moves']` moves of self-play,
+        with the visits, priors and values of its children, keyed by the Zobrist hash of the board (see get_hash() of the game)
+        and the player to move, so that the next games reaching the same position start from these statistics and extend
+        them instead of searching from scratch.
+        The trees depend on the model, so the cache is cleared whenever the model is trained.
+        The least recently used entry is evicted once the cache holds `capacity` entries.
+    ## Methods:
+        - `load()`: Gives the cached tree of a position to the MCTS, if it has more visits than the tree the MCTS already has.
+          Only the PUCT search uses it, the gumbel search starts from a fresh root.
+        - `store()`: Stores the tree of the last search of the MCTS.
+        - `clear()`: Empties the cache.
+        '''
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, game, board, player):
+        return game.get_hash(board), player
+
+    def load(self, mcts, board, player):
+        '''
+        # load
+        ## Description:
+            Makes the MCTS start its next search at the position from a copy of the cached tree.
+        ## Returns:
+            - `visits`: The number of simulations already spent under the root the next search starts from.
+        '''
+        key = self.get_key(mcts.game, board, player)
+        entry = self.entries.get(key)
+        same_root = mcts.tree is not None and mcts.tree.player[0] == player and np.array_equal(mcts.board, board)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            tree, prior = entry
+            if not same_root or tree.visit_count[0] > mcts.tree.visit_count[0]:
+                mcts.tree, mcts.board, mcts.root_prior = tree.extract(0), board.copy(), prior.copy()
+                same_root = True
+
+        return int(mcts.tree.visit_count[0] - 1) if same_root else 0
+
+    def store(self, mcts, board, player):
+        if mcts.tree is None or mcts.root_prior is None or mcts.tree.player[0] != player or not np.array_equal(mcts.board, board):
+            return
+        key = self.get_key(mcts.game, board, player)
+        self.entries[key] = (mcts.tree.extract(0, depth=1), mcts.root_prior.copy())
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
 
 class MCTS:
-    def __init__(self, model, game, args):
+    def __init__(self, model, game, args, cache=None):
         self.model = model
         self.game = game
         self.args = args
-        
-    @torch.no_grad()
-    def search(self, state, player):
-        root = Node(self.game, self.args, state, player, visit_count=1)
-        
-        policy, _ = self.model(
-            torch.tensor(self.game.get_encoded_state(state), device=self.model.device).unsqueeze(0)
-        )
-        policy = torch.softmax(policy, axis=1).squeeze(0).cpu().numpy()
-        policy = (1 - self.args['dirichlet_epsilon']) * policy + self.args['dirichlet_epsilon'] \
-            * np.random.dirichlet([self.args['dirichlet_alpha']] * self.game.action_size)
-        
-        valid_moves = self.game.get_valid_moves(state, player)
+        self.cache = cache
+        # tree of the last search, with the board of its root and the priors of its root without noise
+        self.tree = None
+        self.board = None
+        self.root_prior = None
+        # simulations run and simulations skipped by the early stop of search(), over all the searches
+        self.stats = {'searches': 0, 'saved_searches': 0}
+        # value of the root of the last search for its player to move
+        self.root_value = 0
+        # exact solver for the leaves with at most args['solver_empties'] empty squares, if the game has one
+        self.solver = game.get_solver(args)
+
+    def reset(self):
+        '''
+        # reset
+        ## Description:
+            Drops the tree kept from the previous searches, e.g. before a new game.
+        '''
+        self.tree = None
+        self.board = None
+        self.root_prior = None
+
+    def advance(self, action):
+        '''
+        # advance
+        ## Description:
+            Moves the root of the kept tree to the child reached by `action`, whichever player chose it, so the
+            next search starts from the visits already spent under that child. The tree is dropped when reuse is
+            off or the child was never expanded.
+        '''
+        if self.tree is None or not self.args.get('reuse_tree', False):
+            self.reset()
+            return
+
+        player = int(self.tree.player[0])
+        self.board = self.game.get_next_state(self.board, action, player)
+        self.root_prior = None
+
+        children = self.tree.children(0)
+        child = np.flatnonzero(self.tree.action_taken[children] == action)
+        if len(child) and self.tree.is_expanded(children.start + child[0]):
+            self.tree = self.tree.extract(children.start + child[0])
+        else:
+            self.tree = None
+
+    def get_counters(self, board):
+        '''
+        # get_counters
+        ## Description:
+            Builds what the game keeps up to date with a working board while moves are played and undone on it:
+            the piece counts for Attaxx (see Attaxx.get_counts()) and the chains for Go (see Go.get_position()).
+        ## Returns:
+            - `counters`: The keyword arguments of play(), undo() and get_value_and_terminated() for the board.
+        '''
+        if self.args['game'] == 'Attaxx':
+            return {'counts': self.game.get_counts(board)}
+        return {'position': self.game.get_position(board)}
+
+    def get_valid_moves(self, board, tree, node, history, position=None):
+        '''
+        # get_valid_moves
+        ## Description:
+            Returns the valid moves of the player to move in a node, given the working board at that node.
+            For Go, `position` is the GoPosition kept with the working board. With a history, the positions on
+            the path from the root are added to the history while the moves are generated, so that superko is
+            checked against the game and the search line in constant time per move.
+        ## Returns:
+            - `valid_moves`: The valid moves of the player to move in the node.
+        '''
+        player = int(tree.player[node])
+        if self.args['game'] != 'Go':
+            valid_moves = self.game.get_valid_moves(board, player)
+        elif history is None:
+            valid_moves = self.game.get_valid_moves(board, player, position=position)
+        else:
+            path = []
+            parent = node
+            while parent != -1:
+                position_hash = int(tree.hash[parent])
+                if position_hash not in history:
+                    history.add(position_hash)
+                    path.append(position_hash)
+                parent = tree.parent[parent]
+
+            valid_moves = self.game.get_valid_moves(board, player, history, position)
+            history.difference_update(path)
 
         if self.args["game"] == "Attaxx":
+            valid_moves = np.array(valid_moves)
             if np.sum(valid_moves) == 0:
                 valid_moves[-1] = 1
             else:
                 valid_moves[-1] = 0
 
-        policy *= valid_moves
-        policy /= np.sum(policy)
-        root.expand(policy)
-        
-        for search in range(self.args['num_mcts_searches']):
-            node = root
-            while node.is_expanded():
-                node = node.select()
-            
-            value, is_terminal = self.game.get_value_and_terminated(node.state, node.action_taken, node.player)
-            value = self.game.get_opponent_value(value)
-            
-            if node.parent is not None:
-                if node.action_taken == self.game.action_size - 1 and node.parent.action_taken == self.game.action_size - 1 and self.args['game'] == 'Go':
-                    is_terminal = True # if the action is pass when the previous action was also pass, end the game
-
-            if not is_terminal:
-                policy, value = self.model(torch.tensor(self.game.get_encoded_state(node.state), device=self.model.device).unsqueeze(0))
-                policy = torch.softmax(policy, axis=1).squeeze(0).cpu().numpy()
-                valid_moves = self.game.get_valid_moves(node.state, player)
-
-                if self.args["game"] == "Attaxx":
-                    if np.sum(valid_moves) == 0:
-                        valid_moves[-1] = 1
-                    else:
-                        valid_moves[-1] = 0
-
-                policy *= valid_moves
-                policy /= np.sum(policy)
-                
-                value = value.item()
-                node.expand(policy)
+        return valid_moves
 
-            node.backpropagate(value)    
-            
+    @torch.no_grad()
+    def evaluate(self, boards, players):
+        '''
+        # evaluate
+        ## Description:
+            Evaluates a list of boards with one forward pass of the network, each board seen from the perspective of its player to move.
+            With an evaluation cache, only the boards missing from it are sent to the network.
+        ## Returns:
+            - `policy`: The softmax policy of every board.
+            - `value`: The value of every board.
+        '''
+        neutral_states = [self.game.change_perspective(board, player) for board, player in zip(boards, players)]
+        policy = np.zeros((len(boards), self.game.action_size), dtype=np.float32)
+        value = np.zeros(len(boards), dtype=np.float32)
+
+        missing = []
+        for i, neutral_state in enumerate(neutral_states):
+            entry = self.cache.get(neutral_state) if self.cache is not None else None
+            if entry is None:
+                missing.append(i)
+            else:
+                policy[i], value[i] = entry
+
+        if len(missing) > 0:
+            encoded_states = np.stack([self.game.get_encoded_state(neutral_states[i]) for i in missing])
+            missing_policy, missing_value = self.model(torch.tensor(encoded_states, device=self.model.device))
+            policy[missing] = torch.softmax(missing_policy, axis=1).cpu().numpy()
+            value[missing] = missing_value.squeeze(1).cpu().numpy()
+            if self.cache is not None:
+                for i in missing:
+                    self.cache.put(neutral_states[i], policy[i], value[i])
+
+        return policy, value
+
+    def expand_root(self, tree, board, policy, history, noise=True, position=None):
+        '''
+        # expand_root
+        ## Description:
+            Expands the root of a new tree with the policy of the network, mixed with Dirichlet noise unless `noise` is False, and restricted to the valid moves.
+        ## Returns:
+            - `prior`: The priors of the children of the root without the noise.
+        '''
+        valid_moves = self.get_valid_moves(board, tree, 0, history, position)
+        prior = policy * valid_moves
+        prior /= np.sum(prior)
+
+        if noise:
+            policy = (1 - self.args['dirichlet_epsilon']) * policy + self.args['dirichlet_epsilon'] \
+                * np.random.dirichlet([self.args['dirichlet_alpha']] * self.game.action_size)
+            policy *= valid_moves
+            policy /= np.sum(policy)
+        else:
+            policy = prior
+
+        tree.expand(0, policy)
+        return prior[tree.action_taken[tree.children(0)]].astype(np.float32)
+
+    def select_leaf(self, tree, board, counters, first_child=None):
+        '''
+        # select_leaf
+        ## Description:
+            Goes down the tree from the root to a leaf, playing the selected actions on the working board, and checks whether the leaf ends the game.
+            The caller undoes the moves once it is done with the board of the leaf. With `first_child`, the child of the root is given instead of selected.
+            With the solver of the game (see get_solver()), a leaf with few enough empty squares is solved exactly and treated as terminal, so its exact value is backed up instead of the network's.
+        ## Returns:
+            - `node`: The leaf.
+            - `moves`: The moves played on the board, to undo in reverse order.
+            - `value`: The value of the leaf for its player to move, if it is terminal.
+            - `is_terminal`: Whether the leaf ends the game.
+        '''
+        node = 0
+        moves = []
+        while tree.is_expanded(node):
+            node = tree.select(node) if node != 0 or first_child is None else first_child
+            moves.append(self.game.play(board, tree.action_taken[node], -int(tree.player[node]), **counters))
+
+        action_taken = tree.action_taken[node]
+        value, is_terminal = self.game.get_value_and_terminated(board, action_taken, -int(tree.player[node]), **counters)
+        value = self.game.get_opponent_value(value)
+
+        if action_taken == self.game.action_size - 1 and tree.action_taken[tree.parent[node]] == self.game.action_size - 1 and self.args['game'] == 'Go':
+            is_terminal = True # if the action is pass when the previous action was also pass, end the game
+
+        if not is_terminal and self.solver is not None and counters['counts'][0] <= self.args['solver_empties']:
+            solved_value = self.solver.solve(board, int(tree.player[node]), counters['counts'])
+            if solved_value is not None:
+                value, is_terminal = solved_value, True
+
+        return node, moves, value, is_terminal
+
+    def get_valid_moves_batch(self, boards, trees, nodes, histories, positions):
+        '''
+        # get_valid_moves_batch
+        ## Description:
+            Returns the valid moves of the leaves selected in a round of simulate(), given the working boards at the leaves
+            and, for Go, their GoPositions. MCTSParallel generates them with one batched call instead.
+        ## Returns:
+            - `valid_moves`: The valid moves of every leaf.
+        '''
+        return [self.get_valid_moves(board, tree, node, history, position)
+                for board, tree, node, history, position in zip(boards, trees, nodes, histories, positions)]
+
+    def simulate(self, searches, next_child):
+        '''
+        # simulate
+        ## Description:
+            Runs one step of simulations in the trees of `searches`, a list of (tree, working board, counters, history), one per game.
+            The step goes in up to `args['leaf_batch_size']` rounds: each round selects a leaf in every tree (see select_leaf()),
+            generates the moves of all the leaves while the working boards are still at them and marks them with a virtual loss,
+            so that the next rounds look elsewhere. The leaves of all the rounds are then evaluated in a single forward pass,
+            expanded and backed up. Terminal leaves are backed up right away.
+
+            Before each simulation, `next_child(game, simulation)` gives the child of the root it must go through, None to select
+            it with PUCT, or -1 to end the step of that game. A simulation that reaches a leaf already waiting for the network
+            also ends the step of its game without being counted, so the same child is asked for again in the next step.
+        ## Returns:
+            - `simulations`: The number of simulations run in every tree.
+        '''
+        leaf_batch_size = self.args.get('leaf_batch_size', 1)
+        virtual_loss = self.args.get('virtual_loss', 1)
+
+        simulations = [0] * len(searches)
+        stopped = [False] * len(searches)
+        leaves = []
+        boards = []
+        valid_moves = []
+
+        for _ in range(leaf_batch_size):
+            selected = []
+            played = []
+            for i, (tree, board, counters, history) in enumerate(searches):
+                if stopped[i]:
+                    continue
+                child = next_child(i, simulations[i])
+                if child == -1:
+                    stopped[i] = True
+                    continue
+
+                node, moves, value, is_terminal = self.select_leaf(tree, board, counters, child)
+                played.append((i, moves))
+                if (i, node) in leaves:
+                    # the virtual loss was not enough to steer away from a leaf already waiting for the network
+                    stopped[i] = True
+                    continue
+                simulations[i] += 1
+
+                if is_terminal:
+                    tree.backpropagate(node, value)
+                else:
+                    if self.args['game'] == 'Go':
+                        tree.hash[node] = counters['position'].hash
+                    tree.add_virtual_loss(node, virtual_loss)
+                    selected.append((i, node))
+
+            # the working boards stay at their leaves until the moves of the leaves are generated
+            if len(selected) > 0:
+                valid_moves.extend(self.get_valid_moves_batch([searches[i][1] for i, _ in selected], [searches[i][0] for i, _ in selected],
+                                                              [node for _, node in selected], [searches[i][3] for i, _ in selected],
+                                                              [searches[i][2].get('position') for i, _ in selected]))
+                boards.extend(searches[i][1].copy() for i, _ in selected)
+                leaves.extend(selected)
+
+            for i, moves in played:
+                tree, board, counters, _ = searches[i]
+                for move in reversed(moves):
+                    self.game.undo(board, move, **counters)
+
+            if all(stopped):
+                break
+
+        if len(leaves) == 0:
+            return simulations
+
+        policy, value = self.evaluate(boards, [searches[i][0].player[node] for i, node in leaves])
+        for j, (i, node) in enumerate(leaves):
+            tree = searches[i][0]
+            tree.add_virtual_loss(node, -virtual_loss)
+
+            leaf_policy = policy[j] * valid_moves[j]
+            leaf_policy /= np.sum(leaf_policy)
+            tree.expand(node, leaf_policy)
+            tree.backpropagate(node, value[j].item())
+
+        return simulations
+
+    @torch.no_grad()
+    def search(self, state, player, history=None, time_limit=None, early_stop=False, num_searches=None, noise=True):
+        '''
+        # search
+        ## Description:
+            Runs the MCTS from the given board, where `player` is the player to move. The actions are played
+            on a single working copy of the board and undone after each simulation, and the network sees the
+            board from the perspective of the player to move. For Go, `history` is the set of hashes of the
+            previous positions of the game, used to reject moves that repeat one of them.
+
+            With `args['leaf_batch_size']` K > 1, each step selects up to K leaves, marking every one of them
+            with a virtual loss so that the next selections look elsewhere, evaluates them in a single forward
+            pass and then backs up all of them (see simulate()).
+
+            The tree is kept after the search, and with `args['reuse_tree']` advance() moves its root along the
+            moves of the game. When the next search starts from the board of that root, the visits already under
+            it count towards `args['num_mcts_searches']` and fresh Dirichlet noise is mixed into its priors.
+
+            With a `time_limit` in seconds, the search also stops at that deadline if it comes before the last
+            simulation, and returns the visit count distribution reached so far.
+
+            With `early_stop`, the search stops as soon as no other child of the root can catch up with the most
+            visited one in the simulations left, since the rest would not change the argmax. The visit counts are
+            then not a full search policy, so this is meant for play, not for self-play targets.
+
+            `num_searches` overrides `args['num_mcts_searches']`, and `noise=False` leaves the priors of the root
+            without Dirichlet noise, as for the fast searches of self-play that are not used as targets.
+        ## Returns:
+            - `action_probs`: The visit count distribution over the actions of the root.
+        '''
+        deadline = time.monotonic() + time_limit if time_limit is not None else math.inf
+        num_searches = num_searches if num_searches is not None else self.args['num_mcts_searches']
+
+        board = state.copy()
+        root = 0
+        # Attaxx keeps the piece counts of the working board up to date, so terminal checks don't scan the board,
+        # and Go keeps the chains of the working board, so move generation doesn't rebuild them
+        counters = self.get_counters(board)
+
+        tree = self.tree
+        if tree is not None and tree.is_expanded(root) and tree.player[root] == player and np.array_equal(self.board, board):
+            children = tree.children(root)
+            if self.root_prior is None:
+                self.root_prior = tree.prior[children].copy()
+            if noise:
+                tree.prior[children] = (1 - self.args['dirichlet_epsilon']) * self.root_prior + self.args['dirichlet_epsilon'] \
+                    * np.random.dirichlet([self.args['dirichlet_alpha']] * len(self.root_prior))
+            else:
+                tree.prior[children] = self.root_prior
+        else:
+            tree = SearchTree(self.game, self.args)
+            tree.add_root(player)
+            if self.args['game'] == 'Go':
+                tree.hash[root] = counters['position'].hash
+
+            policy, _ = self.evaluate([board], [player])
+            self.root_prior = self.expand_root(tree, board, policy[0], history, noise, counters.get('position'))
+
+        self.tree, self.board = tree, board.copy()
+
+        searches = tree.visit_count[root] - 1
+        first_search = searches
+        while searches < num_searches and time.monotonic() < deadline:
+            if early_stop and tree.num_children[root] > 1:
+                visits = np.partition(tree.visit_count[tree.children(root)], -2)
+                if visits[-1] - visits[-2] > num_searches - searches:
+                    self.stats['saved_searches'] += int(num_searches - searches)
+                    break
+
+            searches += self.simulate([(tree, board, counters, history)],
+                                      lambda _, i: None if searches + i < num_searches and time.monotonic() < deadline else -1)[0]
+
+        self.stats['searches'] += int(searches - first_search)
+        self.root_value = tree.value_sum[root] / tree.visit_count[root]
+        return tree.get_action_probs(root)
+
+    @torch.no_grad()
+    def gumbel_search(self, state, player, history=None, num_searches=None):
+        '''
+        # gumbel_search
+        ## Description:
+            Runs a Gumbel MuZero search from the given board: instead of Dirichlet noise and PUCT at the root, it samples
+            `args['gumbel_considered']` actions without replacement with the Gumbel-top-k trick and shares the simulations
+            between them by sequential halving, keeping the best half after each phase according to
+            gumbel + logits + sigma(Q). Below the root, the simulations select children with PUCT as in search().
+            The policy target is the softmax of logits + sigma(completed Q), where the children that were never visited
+            get the mixed value of the root, so it improves on the prior with any number of simulations.
+        ## Returns:
+            - `action_probs`: The improved policy over the actions of the root.
+            - `action`: The action chosen by the sequential halving, to be played without temperature.
+        '''
+        num_searches = num_searches if num_searches is not None else self.args['num_mcts_searches']
+        c_visit = self.args.get('gumbel_c_visit', 50)
+        c_scale = self.args.get('gumbel_c_scale', 1.0)
+        self.reset()
+
+        board = state.copy()
+        root = 0
+        counters = self.get_counters(board)
+
+        tree = SearchTree(self.game, self.args)
+        tree.add_root(player)
+        if self.args['game'] == 'Go':
+            tree.hash[root] = counters['position'].hash
+
+        policy, root_value = self.evaluate([board], [player])
+        self.expand_root(tree, board, policy[0], history, noise=False, position=counters.get('position'))
+
+        children = tree.children(root)
+        actions = tree.action_taken[children]
+        logits = np.log(tree.prior[children].astype(np.float64))
+        gumbel = np.random.gumbel(size=len(actions))
+
+        def sigma(q):
+            # the Q values of the tree are already in [0, 1], seen from the player to move at the root
+            return (c_visit + tree.visit_count[children].max()) * c_scale * q
+
+        # every phase visits each candidate at least once, which takes about twice as many simulations as candidates
+        considered = min(self.args.get('gumbel_considered', 16), len(actions), max(1, num_searches // 2))
+        candidates = np.argsort(-(gumbel + logits))[:considered]
+        phases = math.ceil(math.log2(considered)) if considered > 1 else 0
+
+        searches = 0
+        for phase in range(phases):
+            visits = max(1, num_searches // (phases * len(candidates)))
+            if phase == phases - 1:
+                visits = max(visits, (num_searches - searches) // len(candidates))
+            pending = [children.start + candidate for _ in range(visits) for candidate in candidates]
+
+            # the simulations take the candidates from the end of pending, each through its own child of the root
+            while len(pending) > 0:
+                simulations = self.simulate([(tree, board, counters, history)],
+                                            lambda _, i: pending[-1 - i] if i < len(pending) else -1)[0]
+                del pending[len(pending) - simulations:]
+                searches += simulations
+
+            scores = gumbel[candidates] + logits[candidates] + sigma(tree.q_value[children][candidates])
+            candidates = candidates[np.argsort(-scores)[:max(1, math.ceil(len(candidates) / 2))]]
+
+        self.stats['searches'] += searches
+        self.root_value = tree.value_sum[root] / tree.visit_count[root]
+        action = actions[candidates[0]]
+
+        # completed Q: the children without visits get the value of the root mixed with the Q of the visited ones
+        visit_count = tree.visit_count[children]
+        q_value = tree.q_value[children]
+        visited = visit_count > 0
+        mixed_value = (root_value[0] + 1) / 2
+        if visited.any():
+            prior = tree.prior[children]
+            visited_q = np.sum(prior[visited] * q_value[visited]) / np.sum(prior[visited])
+            mixed_value = (mixed_value + visit_count.sum() * visited_q) / (1 + visit_count.sum())
+        completed_q = np.where(visited, q_value, mixed_value)
+
+        improved_policy = logits + sigma(completed_q)
+        improved_policy = np.exp(improved_policy - improved_policy.max())
         action_probs = np.zeros(self.game.action_size)
-        for child in root.children:
-            action_probs[child.action_taken] = child.visit_count
-        action_probs /= np.sum(action_probs)
-        return action_probs
+        action_probs[actions] = improved_policy / np.sum(improved_policy)
+        return action_probs, action
 
 class AlphaZero:
     def __init__(self, model, optimizer, game, args):
@@ -230,7 +877,14 @@ class AlphaZero:
         self.optimizer = optimizer
         self.game = game
         self.args = args
-        self.mcts = MCTS(model, game, args)
+        # evaluations are shared by all the self-play games of an iteration, and dropped once the model is trained
+        self.cache = EvaluationCache(game, args, args['cache_size']) if args.get('cache_size', 0) > 0 else None
+        self.mcts = MCTS(model, game, args, self.cache)
+        # resignation threshold, recalibrated with the games played out to the end, and the values it is calibrated on
+        self.resign_threshold = args.get('resign_threshold', None)
+        self.resign_samples = []
+        # search trees of the opening positions, shared by the self-play games and dropped once the model is trained
+        self.openings = OpeningCache(args['opening_cache_size']) if args.get('opening_moves', 0) > 0 else None
 
     def augment_state(self, state, probs):
 
@@ -275,25 +929,63 @@ class AlphaZero:
         return augmented_states, augmented_action_probs
 
 
-    def selfPlay(self):
+    def selfPlay(self, calibrate=True):
         memory = []
         player = 1
         state = self.game.get_initial_state()
+        history = {self.game.get_hash(state)} if self.args['game'] == 'Go' else None
+        position = self.game.get_position(state) if self.args['game'] == 'Go' else None
         iter = 0
         prev_skip = False
+        self.mcts.reset()
+
+        # a fraction of the games is played out to the end even when a player would resign, to calibrate the threshold
+        resign = self.resign_threshold is not None and random.random() >= self.args.get('resign_playout_fraction', 0.1)
+        root_values = {1: [], -1: []}
+        low_value_moves = {1: 0, -1: 0}
+        # calibration samples of this game, kept for the trainer when a worker plays it (calibrate=False)
+        self.game_resign_samples = []
 
         debugging = False
 
         while True:
+            if resign and low_value_moves[player] >= self.args.get('resign_moves', 3):
+                return self.get_game_memory(memory, -1, player)
+
             if self.args["game"] == "Attaxx" and debugging:
                 print("\nSEARCHING...")
             neutral_state = self.game.change_perspective(state, player)
-            action_probs = self.mcts.search(state, player)
-            memory.append((neutral_state, action_probs, player))
+            # playout cap randomization: only a fraction of the moves get a full search and become training targets,
+            # the others use a small search without noise that only picks the move
+            full_search = random.random() < self.args.get('full_search_prob', 1)
+            num_searches = self.args['num_mcts_searches'] if full_search else self.args['fast_mcts_searches']
+
+            # the gumbel search always starts from a fresh root, so only the PUCT search uses the opening cache
+            gumbel = full_search and self.args.get('root_policy', 'puct') == 'gumbel'
 
-            temperature_action_probs = action_probs ** (1 / self.args['temperature'])
-            temperature_action_probs /= np.sum(temperature_action_probs)
-            action = np.random.choice(self.game.action_size, p=temperature_action_probs)
+            # in the opening, the search starts from the tree cached by the previous games and adds at least a few simulations to it
+            opening = self.openings is not None and not gumbel and iter < self.args['opening_moves']
+            if opening:
+                visits = self.openings.load(self.mcts, state, player)
+                num_searches = max(num_searches, visits + self.args.get('opening_extra_searches', 0))
+
+            if gumbel:
+                action_probs, action = self.mcts.gumbel_search(state, player, history)
+            else:
+                action_probs = self.mcts.search(state, player, history, num_searches=num_searches, noise=full_search)
+                if opening:
+                    self.openings.store(self.mcts, state, player)
+
+                temperature_action_probs = action_probs ** (1 / self.args['temperature'])
+                temperature_action_probs /= np.sum(temperature_action_probs)
+                action = np.random.choice(self.game.action_size, p=temperature_action_probs)
+
+            if full_search:
+                memory.append((neutral_state, action_probs, player))
+
+            if self.resign_threshold is not None:
+                root_values[player].append(self.mcts.root_value)
+                low_value_moves[player] = low_value_moves[player] + 1 if self.mcts.root_value < self.resign_threshold else 0
 
             if self.args["game"] == "Go":
                 print(f"\nPlayer: {player}")
@@ -302,7 +994,10 @@ class AlphaZero:
                 else:
                     print(f"Action: Skip")
                 
-            state = self.game.get_next_state(state, action, player)
+            if self.args["game"] == "Go":
+                state = self.game.get_next_state(state, action, player, history, position)
+            else:
+                state = self.game.get_next_state(state, action, player)
 
             if self.args["game"] == "Attaxx" and debugging:
                 print(f"Player: {player} with move {self.game.int_to_move(action)}\nBoard:")
@@ -326,19 +1021,122 @@ class AlphaZero:
                 prev_skip = False
 
             if is_terminal or iter >= self.args['max_moves']:
-                returnMemory = []
                 if self.args["game"] == "Attaxx" and debugging:
                     print("GAME OVER\n\n")
-                for hist_neutral_state, hist_action_probs, hist_player in memory:
-                    hist_outcome = value if hist_player == player else self.game.get_opponent_value(value)
-
-                    returnMemory.append((self.game.get_encoded_state(hist_neutral_state), hist_action_probs, hist_outcome))
-
-                return returnMemory
+                if self.resign_threshold is not None and not resign:
+                    self.game_resign_samples = self.get_resign_samples(root_values, value, player)
+                    if calibrate:
+                        self.calibrate_resign_threshold(self.game_resign_samples)
+                return self.get_game_memory(memory, value, player)
 
+            self.mcts.advance(action)
             player = self.game.get_opponent(player)
             iter += 1
                 
+    def get_game_memory(self, memory, value, player):
+        '''
+        # get_game_memory
+        ## Description:
+            Turns the memory of a finished game into training samples, where `value` is the outcome for `player`.
+        '''
+        returnMemory = []
+        for hist_neutral_state, hist_action_probs, hist_player in memory:
+            hist_outcome = value if hist_player == player else self.game.get_opponent_value(value)
+
+            returnMemory.append((self.game.get_encoded_state(hist_neutral_state), hist_action_probs, hist_outcome))
+
+        return returnMemory
+
+    def get_resign_samples(self, root_values, value, player):
+        '''
+        # get_resign_samples
+        ## Description:
+            Finds the calibration samples of a game played out to the end, where `value` is the outcome for `player`.
+            A player that did not lose would have resigned wrongly if `args['resign_moves']` of its consecutive root values
+            were all below the threshold, that is if the lowest of the maxima over its windows of that many moves was.
+        ## Returns:
+            - `samples`: That value for every player that did not lose.
+        '''
+        resign_moves = self.args.get('resign_moves', 3)
+        outcomes = {player: value, self.game.get_opponent(player): self.game.get_opponent_value(value)}
+        samples = []
+        for hist_player, values in root_values.items():
+            if outcomes[hist_player] >= 0 and len(values) >= resign_moves:
+                windows = np.lib.stride_tricks.sliding_window_view(np.array(values), resign_moves)
+                samples.append(float(windows.max(axis=1).min()))
+        return samples
+
+    def calibrate_resign_threshold(self, samples):
+        '''
+        # calibrate_resign_threshold
+        ## Description:
+            Updates the resignation threshold with the samples of a game played out to the end (see get_resign_samples()).
+            The threshold is set to the quantile of the samples at `args['resign_false_positive_rate']` over the last
+            `args['resign_samples']` games, so that about that fraction of the games would have been resigned wrongly.
+        '''
+        self.resign_samples += samples
+        self.resign_samples = self.resign_samples[-self.args.get('resign_samples', 500):]
+        if len(self.resign_samples) >= 10:
+            threshold = np.quantile(self.resign_samples, self.args.get('resign_false_positive_rate', 0.05))
+            self.resign_threshold = float(np.clip(threshold, -1, 0))
+
+    def selfPlay_workers(self):
+        '''
+        # selfPlay_workers
+        ## Description:
+            Plays the `args['num_selfPlay_iterations']` games of an iteration in `args['num_workers']` processes. Every worker
+            takes games from a shared queue until there are none left and sends back the memory of each game as soon as it
+            is finished. The workers read the weights of the model from shared memory, or send their states to a single
+            inference server when `args['inference_server']` is set.
+            The workers resign with the threshold of the trainer and send back the calibration samples and cache counters
+            of each game, the trainer calibrates the threshold with them for the next iteration.
+        ## Returns:
+            - `memory`: The memory of all the games, in the order they were finished.
+        '''
+        num_workers = self.args['num_workers']
+        context = mp.get_context('spawn')
+        games = context.Queue()
+        results = context.Queue()
+        for _ in range(self.args['num_selfPlay_iterations']):
+            games.put(True)
+        for _ in range(num_workers):
+            games.put(None)
+
+        server = None
+        if self.args.get('inference_server', False):
+            server = InferenceServer(self.model, self.args, num_workers)
+            server.start()
+        else:
+            self.model.share_memory()
+
+        seeds = np.random.randint(2**31, size=num_workers)
+        workers = []
+        for worker_id in range(num_workers):
+            model = server.client(worker_id) if server is not None else self.model
+            worker = context.Process(target=selfPlay_worker, args=(model, self.game, self.args, int(seeds[worker_id]), self.resign_threshold, games, results))
+            worker.start()
+            workers.append(worker)
+
+        memory = []
+        counters = np.zeros(4, dtype=np.int64)
+        for _ in trange(self.args['num_selfPlay_iterations']):
+            game_memory, resign_samples, game_counters = results.get()
+            memory += game_memory
+            counters += game_counters
+            if self.resign_threshold is not None and len(resign_samples) > 0:
+                self.calibrate_resign_threshold(resign_samples)
+
+        for worker in workers:
+            worker.join()
+        if server is not None:
+            print(f"Inference server: {server.stop()}")
+        if self.cache is not None:
+            print(f"Evaluation cache: {counters[0]} hits, {counters[1]} misses over {num_workers} workers")
+        if self.openings is not None:
+            print(f"Opening cache: {counters[2]} hits, {counters[3]} misses over {num_workers} workers")
+
+        return memory
+
     def train(self, memory):
         random.shuffle(memory)
         for batchIdx in range(0, len(memory), self.args['batch_size']):
@@ -369,15 +1167,31 @@ class AlphaZero:
 
             secondary_memory = []
 
-            for selfPlay_iteration in trange(self.args['num_selfPlay_iterations']):
-                states = self.selfPlay()
-                secondary_memory += states
+            self.model.eval()
+
+            if self.args.get('num_workers', 1) > 1:
+                secondary_memory += self.selfPlay_workers()
+            else:
+                for selfPlay_iteration in trange(self.args['num_selfPlay_iterations']):
+                    states = self.selfPlay()
+                    secondary_memory += states
+
+                    if selfPlay_iteration == 1:
+                        file_path = 'selfplay1'
+                        with open(file_path, 'w') as file:
+                            for item in secondary_memory:
+                                file.write(f"{item}\n")
+
+                if self.cache is not None:
+                    print(f"Evaluation cache: {self.cache.hits} hits, {self.cache.misses} misses, {len(self.cache.entries)} entries")
+                    self.cache.clear()
 
-                if selfPlay_iteration == 1:
-                    file_path = 'selfplay1'
-                    with open(file_path, 'w') as file:
-                        for item in secondary_memory:
-                            file.write(f"{item}\n")
+                if self.openings is not None:
+                    print(f"Opening cache: {self.openings.hits} hits, {self.openings.misses} misses, {len(self.openings.entries)} entries")
+                    self.openings.clear()
+
+            if self.resign_threshold is not None:
+                print(f"Resign threshold: {self.resign_threshold:.3f}")
 
             training_memory = []
 
@@ -397,4 +1211,31 @@ class AlphaZero:
             print("\n")
                 
             torch.save(self.model.state_dict(), f"AlphaZero/Models/{self.args['alias']}/model_{iteration+20}.pt")
-            torch.save(self.optimizer.state_dict(), f"AlphaZero/Models/{self.args['alias']}/optimizer_{iteration+20}.pt")
\ No newline at end of file
+            torch.save(self.optimizer.state_dict(), f"AlphaZero/Models/{self.args['alias']}/optimizer_{iteration+20}.pt")
+
+
+def selfPlay_worker(model, game, args, seed, resign_threshold, games, results):
+    '''
+    ## Description:
+        The loop of a self-play worker process, see AlphaZero.selfPlay_workers(). Each worker uses a single thread so that
+        the workers don't compete for the cores. The counters sent with a game are the cache hits and misses since the
+        previous game.
+        '''
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    model.eval()
+    alphaZero = AlphaZero(model, None, game, args)
+    alphaZero.resign_threshold = resign_threshold
+    counters = np.zeros(4, dtype=np.int64)
+    while games.get() is not None:
+        memory = alphaZero.selfPlay(calibrate=False)
+
+        previous = counters.copy()
+        if alphaZero.cache is not None:
+            counters[:2] = alphaZero.cache.hits, alphaZero.cache.misses
+        if alphaZero.openings is not None:
+            counters[2:] = alphaZero.openings.hits, alphaZero.openings.misses
+        results.put((memory, alphaZero.game_resign_samples, counters - previous))
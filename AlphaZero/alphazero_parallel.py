@@ -7,9 +7,13 @@ import torch.nn.functional as F
 import os
 from tqdm import trange
 
+from AlphaZero.alphaZero import SearchTree
+from AlphaZero.alphaZero import MCTS
+
 class ResNetParallel(nn.Module):
-    def __init__(self, game, num_resBlocks, num_hidden):
+    def __init__(self, game, num_resBlocks, num_hidden, device):
         super().__init__()
+        self.device = device
         self.startBlock = nn.Sequential(
             nn.Conv2d(3, num_hidden, kernel_size=3, padding=1),
             nn.BatchNorm2d(num_hidden),
@@ -36,6 +40,8 @@ class ResNetParallel(nn.Module):
             nn.Linear(3 * game.row_count * game.column_count, 1),
             nn.Tanh()
         )
+
+        self.to(device)
         
     def forward(self, x):
         x = self.startBlock(x)
@@ -62,123 +68,87 @@ class ResBlock(nn.Module):
         x = F.relu(x)
         return x
 
-class Node:
-    def __init__(self, game, args, state, parent=None, action_taken=None, prior=0, visit_count=0):
-        self.game = game
-        self.args = args
-        self.state = state
-        self.parent = parent
-        self.action_taken = action_taken
-        self.prior = prior
-        self.children = []
-        
-        self.visit_count = visit_count
-        self.value_sum = 0
-        
-    def is_expanded(self):
-        return len(self.children) > 0
-    
-    def select(self):
-        best_child = None
-        best_ucb = -np.inf
-        
-        for child in self.children:
-            ucb = self.get_ucb(child)
-            if ucb > best_ucb:
-                best_child = child
-                best_ucb = ucb
-                
-        return best_child
-    
-    def get_ucb(self, child):
-        if child.visit_count == 0:
-            q_value = 0
-        else:
-            q_value = 1 - ((child.value_sum / child.visit_count) + 1) / 2
-        return q_value + self.args['C'] * (math.sqrt(self.visit_count) / (child.visit_count + 1)) * child.prior
-    
-    def expand(self, policy):
-        for action, prob in enumerate(policy):
-            if prob > 0:
-                child_state = self.state.copy()
-                child_state = self.game.get_next_state(child_state, action, 1)
-                child_state = self.game.change_perspective(child_state, player=-1)
+class MCTSParallel(MCTS):
+    '''
+    # MCTS Parallel
+    ## Description:
+        Runs one MCTS per self-play game and evaluates the leaves of all the games in a single forward pass.
+        Each game has its own tree, working board and player to move, so games of any length can share the batch.
+        '''
+    def get_valid_moves_batch(self, boards, trees, nodes, histories, positions):
+        '''
+        # get_valid_moves_batch
+        ## Description:
+            Returns the valid moves of the player to move in a leaf of every game, given the working boards at the leaves,
+            with one call to the batched move generation of the game instead of one call per leaf as in MCTS.
+            For Go with a history, only the moves it finds valid are checked for superko, against the history and the
+            positions on the path from the root: the hash of a move is the hash of the leaf with the stone added, and
+            the few moves that capture also remove the hashes of the captured chains, read from the GoPosition of the
+            working board at the leaf.
+        ## Returns:
+            - `valid_moves`: The valid moves of every leaf.
+        '''
+        players = np.array([tree.player[node] for tree, node in zip(trees, nodes)])
+        if self.args['game'] != 'Go':
+            valid_moves = self.game.get_valid_moves_batch(np.stack(boards), players)
+            if self.args['game'] == 'Attaxx':
+                valid_moves[:, -1] = ~valid_moves[:, :-1].any(axis=1)
+            return valid_moves
 
-                child = Node(self.game, self.args, child_state, self, action, prob)
-                self.children.append(child)
-            
-    def backpropagate(self, value):
-        self.value_sum += value
-        self.visit_count += 1
-        
-        if self.parent is not None:
-            value = self.game.get_opponent_value(value)
-            self.parent.backpropagate(value)  
+        valid_moves, captures = self.game.get_valid_moves_batch(np.stack(boards), players, captures=True)
+        for i, (tree, node, history) in enumerate(zip(trees, nodes, histories)):
+            if history is None:
+                continue
+            path = set()
+            parent = node
+            while parent != -1:
+                path.add(int(tree.hash[parent]))
+                parent = tree.parent[parent]
 
+            player = int(players[i])
+            points = np.flatnonzero(valid_moves[i, :-1])
+            hashes = np.uint64(tree.hash[node]) ^ self.game.zobrist[0 if player == self.game.BLACK else 1][points]
+            for j in np.flatnonzero(captures[i, points]):
+                hashes[j] = positions[i].get_move_hash(points[j], player)
 
-class MCTSParallel:
-    def __init__(self, game, args, model):
-        self.game = game
-        self.args = args
-        self.model = model
-        
-    @torch.no_grad()
-    def search(self, states, spGames):
-        policy, _ = self.model(
-            torch.tensor(self.game.get_encoded_state(states), device=self.model.device)
-        )
-        policy = torch.softmax(policy, axis=1).cpu().numpy()
-        policy = (1 - self.args['dirichlet_epsilon']) * policy + self.args['dirichlet_epsilon'] \
-            * np.random.dirichlet([self.args['dirichlet_alpha']] * self.game.action_size, size=policy.shape[0])
-        
-        for i, spg in enumerate(spGames):
-            spg_policy = policy[i]
-            valid_moves = self.game.get_valid_moves(states[i])
-            spg_policy *= valid_moves
-            spg_policy /= np.sum(spg_policy)
+            move_hashes = hashes.tolist()
+            repeated = history.intersection(move_hashes) | path.intersection(move_hashes)
+            if repeated:
+                valid_moves[i, points[np.isin(hashes, np.array(list(repeated), dtype=np.uint64))]] = 0
 
-            spg.root = Node(self.game, self.args, states[i], visit_count=1)
-            spg.root.expand(spg_policy)
-        
-        for search in range(self.args['num_searches']):
-            for spg in spGames:
-                spg.node = None
-                node = spg.root
+        return valid_moves
 
-                while node.is_fully_expanded():
-                    node = node.select()
+    @torch.no_grad()
+    def search(self, spGames):
+        '''
+        # search
+        ## Description:
+            Runs `args['num_mcts_searches']` simulations in the tree of every game, each game searching from its own board for its own player.
+            Every step of simulate() selects the leaves of all the games, so they are evaluated in a single forward pass.
+        ## Returns:
+            - `action_probs`: The visit count distribution over the actions of the root of every game.
+        '''
+        policy, _ = self.evaluate([spg.state for spg in spGames], [spg.player for spg in spGames])
 
-                value, is_terminal = self.game.get_value_and_terminated(node.state, node.action_taken)
-                value = self.game.get_opponent_value(value)
-                
-                if is_terminal:
-                    node.backpropagate(value)
-                    
-                else:
-                    spg.node = node
-                    
-            expandable_spGames = [mappingIdx for mappingIdx in range(len(spGames)) if spGames[mappingIdx].node is not None]
-                    
-            if len(expandable_spGames) > 0:
-                states = np.stack([spGames[mappingIdx].node.state for mappingIdx in expandable_spGames])
-                
-                policy, value = self.model(
-                    torch.tensor(self.game.get_encoded_state(states), device=self.model.device)
-                )
-                policy = torch.softmax(policy, axis=1).cpu().numpy()
-                value = value.cpu().numpy()
-                
-            for i, mappingIdx in enumerate(expandable_spGames):
-                node = spGames[mappingIdx].node
-                spg_policy, spg_value = policy[i], value[i]
-                
-                valid_moves = self.game.get_valid_moves(node.state)
-                spg_policy *= valid_moves
-                spg_policy /= np.sum(spg_policy)
+        boards = []
+        counters = []
+        for i, spg in enumerate(spGames):
+            spg.tree = SearchTree(self.game, self.args)
+            spg.tree.add_root(spg.player)
+            if self.args['game'] == 'Go':
+                spg.tree.hash[0] = spg.position.hash
+            self.expand_root(spg.tree, spg.state, policy[i], spg.history, position=spg.position)
+
+            boards.append(spg.state.copy())
+            # every working board keeps its piece counts (Attaxx) or chains (Go) up to date, as in MCTS.search()
+            counters.append(self.get_counters(boards[i]))
 
-                node.expand(spg_policy)
-                node.backpropagate(spg_value)
+        searches = [(spg.tree, boards[i], counters[i], spg.history) for i, spg in enumerate(spGames)]
+        simulations = np.zeros(len(spGames), dtype=np.int64)
+        while simulations.min() < self.args['num_mcts_searches']:
+            simulations += self.simulate(searches, lambda i, j: None if simulations[i] + j < self.args['num_mcts_searches'] else -1)
 
+        return [spg.tree.get_action_probs(0) for spg in spGames]
 
 
 class AlphaZeroParallel:
@@ -187,37 +157,59 @@ class AlphaZeroParallel:
         self.optimizer = optimizer
         self.game = game
         self.args = args
-        self.mcts = MCTSParallel(game, args, model)
+        self.mcts = MCTSParallel(model, game, args)
         
     def selfPlay(self):
+        '''
+        # selfPlay
+        ## Description:
+            Plays the `args['num_selfPlay_iterations']` games of an iteration, `args['num_parallel_games']` at a time.
+            As soon as a game is over a new one takes its place, so the batches of the search stay full until the last games.
+        ## Returns:
+            - `return_memory`: The encoded states, visit count distributions and outcomes of all the games.
+        '''
         return_memory = []
-        player = 1
-        spGames = [SPG(self.game) for spg in range(self.args['num_parallel_games'])]
+        games_started = min(self.args['num_parallel_games'], self.args['num_selfPlay_iterations'])
+        spGames = [SPG(self.game, self.args) for spg in range(games_started)]
         
         while len(spGames) > 0:
-            states = np.stack([spg.state for spg in spGames])
-            neutral_states = self.game.change_perspective(states, player)
-            
-            self.mcts.search(neutral_states, spGames)
-            
+            action_probs = self.mcts.search(spGames)
+
+            actions = []
+            for i, spg in enumerate(spGames):
+                spg.memory.append((self.game.change_perspective(spg.state, spg.player), action_probs[i], spg.player))
+
+                temperature_action_probs = action_probs[i] ** (1 / self.args['temperature'])
+                temperature_action_probs /= np.sum(temperature_action_probs)
+                actions.append(np.random.choice(self.game.action_size, p=temperature_action_probs))
+
+            # Go plays each move against the history of its game, Attaxx plays the moves of all the games at once
+            if self.args['game'] == 'Go':
+                for spg, action in zip(spGames, actions):
+                    spg.state = self.game.get_next_state(spg.state, action, spg.player, spg.history, spg.position)
+            else:
+                states = self.game.get_next_states(np.stack([spg.state for spg in spGames]), actions, [spg.player for spg in spGames])
+                for spg, state in zip(spGames, states):
+                    spg.state = state
+
             for i in range(len(spGames))[::-1]:
                 spg = spGames[i]
-                
-                action_probs = np.zeros(self.game.action_size)
-                for child in spg.root.children:
-                    action_probs[child.action_taken] = child.visit_count
-                action_probs /= np.sum(action_probs)
+                player = spg.player
+                action = actions[i]
 
-                spg.memory.append((spg.root.state, action_probs, player))
+                value, is_terminal = self.game.get_value_and_terminated(spg.state, action, player)
 
-                temperature_action_probs = action_probs ** (1 / self.args['temperature'])
-                action = np.random.choice(self.game.action_size, p=temperature_action_probs) # Divide temperature_action_probs with its sum in case of an error
-
-                spg.state = self.game.get_next_state(spg.state, action, player)
+                if action == self.game.action_size - 1 and self.args['game'] == 'Go':
+                    if spg.prev_skip:
+                        is_terminal = True
+                    else:
+                        spg.prev_skip = True
+                else:
+                    spg.prev_skip = False
 
-                value, is_terminal = self.game.get_value_and_terminated(spg.state, action)
+                spg.moves += 1
 
-                if is_terminal:
+                if is_terminal or spg.moves >= self.args['max_moves']:
                     for hist_neutral_state, hist_action_probs, hist_player in spg.memory:
                         hist_outcome = value if hist_player == player else self.game.get_opponent_value(value)
                         return_memory.append((
@@ -225,16 +217,21 @@ class AlphaZeroParallel:
                             hist_action_probs,
                             hist_outcome
                         ))
-                    del spGames[i]
-                    
-            player = self.game.get_opponent(player)
+
+                    if games_started < self.args['num_selfPlay_iterations']:
+                        spGames[i] = SPG(self.game, self.args)
+                        games_started += 1
+                    else:
+                        del spGames[i]
+                else:
+                    spg.player = self.game.get_opponent(player)
             
         return return_memory
                 
     def train(self, memory):
         random.shuffle(memory)
         for batchIdx in range(0, len(memory), self.args['batch_size']):
-            sample = memory[batchIdx:min(len(memory) - 1, batchIdx + self.args['batch_size'])] # Change to memory[batchIdx:batchIdx+self.args['batch_size']] in case of an error
+            sample = memory[batchIdx:batchIdx+self.args['batch_size']]
             state, policy_targets, value_targets = zip(*sample)
             
             state, policy_targets, value_targets = np.array(state), np.array(policy_targets), np.array(value_targets).reshape(-1, 1)
@@ -258,16 +255,22 @@ class AlphaZeroParallel:
             memory = []
             
             self.model.eval()
-            for selfPlay_iteration in trange(self.args['num_selfPlay_iterations'] // self.args['num_parallel_games']):
-                memory += self.selfPlay()
+            memory += self.selfPlay()
                 
             self.model.train()
             for epoch in trange(self.args['num_epochs']):
                 self.train(memory)
+
+            torch.save(self.model.state_dict(), f"AlphaZero/Models/{self.args['alias']}/model_{iteration}.pt")
+            torch.save(self.optimizer.state_dict(), f"AlphaZero/Models/{self.args['alias']}/optimizer_{iteration}.pt")
             
 class SPG:
-    def __init__(self, game):
+    def __init__(self, game, args):
         self.state = game.get_initial_state()
+        self.player = 1
+        self.history = {game.get_hash(self.state)} if args['game'] == 'Go' else None
+        self.position = game.get_position(self.state) if args['game'] == 'Go' else None
         self.memory = []
-        self.root = None
-        self.node = None
\ No newline at end of file
+        self.tree = None
+        self.prev_skip = False
+        self.moves = 0
@@ -0,0 +1,139 @@
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+
+
+class InferenceServer:
+    '''
+    # Inference Server
+    ## Description:
+        Runs the network in a single process for many self-play workers. The workers send their encoded states over a
+        shared request queue, the server gathers the requests into one batch until it holds `args['inference_batch_size']`
+        states, every worker has a request waiting or `args['inference_max_wait']` seconds have passed since the first
+        request, runs one forward pass and sends every worker its part of the output on its own response queue.
+        The model is moved to shared memory, so the weights updated in place by training are seen by the server.
+    ## Methods:
+        - `start()`: Starts the server process.
+        - `client()`: Returns the client a worker uses in place of the model.
+        - `stop()`: Stops the server process and returns its batch-fill and latency statistics.
+        '''
+    def __init__(self, model, args, num_workers):
+        self.model = model
+        self.args = args
+        self.num_workers = num_workers
+        self.max_batch_size = args.get('inference_batch_size', 256)
+        self.max_wait = args.get('inference_max_wait', 0.005)
+
+        self.context = mp.get_context('spawn')
+        self.request_queue = self.context.Queue()
+        self.response_queues = [self.context.Queue() for _ in range(num_workers)]
+        self.stats_queue = self.context.Queue()
+        self.process = None
+
+    def start(self):
+        self.model.share_memory()
+        self.process = self.context.Process(target=serve, args=(self.model, self.request_queue, self.response_queues, self.stats_queue, self.num_workers, self.max_batch_size, self.max_wait), daemon=True)
+        self.process.start()
+
+    def client(self, worker_id):
+        return InferenceClient(self.request_queue, self.response_queues[worker_id], worker_id)
+
+    def stop(self):
+        '''
+        # stop
+        ## Description:
+            Stops the server once it has answered the requests already sent.
+        ## Returns:
+            - `stats`: The number of batches and states, the mean batch fill and the mean and max latency of a request in milliseconds.
+        '''
+        self.request_queue.put(None)
+        stats = self.stats_queue.get()
+        self.process.join()
+        self.process = None
+        return stats
+
+
+class InferenceClient:
+    '''
+    # Inference Client
+    ## Description:
+        Stands in for the model in the MCTS of a worker: calling it sends the encoded states to the inference server and
+        waits for the policy and value, as the forward pass of the model would return them.
+        '''
+    def __init__(self, request_queue, response_queue, worker_id):
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.worker_id = worker_id
+        self.device = 'cpu'
+
+    def __call__(self, states):
+        self.request_queue.put((self.worker_id, states.cpu(), time.monotonic()))
+        return self.response_queue.get()
+
+    def eval(self):
+        return self
+
+
+@torch.no_grad()
+def serve(model, request_queue, response_queues, stats_queue, num_workers, max_batch_size, max_wait):
+    '''
+    ## Description:
+        The loop of the inference server process, see InferenceServer.
+        A worker waits for its answer before sending again, so once every worker has a request in the batch no other
+        request can arrive and the batch is sent without waiting.
+        '''
+    model.eval()
+    batches = 0
+    states_served = 0
+    requests_served = 0
+    latency_sum = 0
+    latency_max = 0
+
+    running = True
+    while running:
+        request = request_queue.get()
+        if request is None:
+            break
+
+        requests = [request]
+        batch_size = len(request[1])
+        deadline = time.monotonic() + max_wait
+        while batch_size < max_batch_size and len(requests) < num_workers:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = request_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                running = False
+                break
+            requests.append(request)
+            batch_size += len(request[1])
+
+        states = torch.cat([states for _, states, _ in requests]).to(model.device)
+        policy, value = model(states)
+        policy, value = policy.cpu(), value.cpu()
+
+        start = 0
+        for worker_id, states, sent in requests:
+            response_queues[worker_id].put((policy[start:start + len(states)], value[start:start + len(states)]))
+            start += len(states)
+
+            latency = time.monotonic() - sent
+            latency_sum += latency
+            latency_max = max(latency_max, latency)
+
+        batches += 1
+        states_served += batch_size
+        requests_served += len(requests)
+
+    stats_queue.put({
+        'batches': batches,
+        'states': states_served,
+        'batch_fill': states_served / (batches * max_batch_size) if batches > 0 else 0,
+        'mean_latency_ms': 1000 * latency_sum / requests_served if requests_served > 0 else 0,
+        'max_latency_ms': 1000 * latency_max,
+    })
@@ -1,13 +1,48 @@
 import numpy as np
 
 class Attaxx:
-    def __init__(self, args):
+    # clones move to one of the 8 neighbours, jumps move 2 squares in a straight or diagonal line
+    OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1),
+               (-2, -2), (-2, 0), (-2, 2), (0, -2), (0, 2), (2, -2), (2, 0), (2, 2)]
+
+    def __init__(self, args, compact_actions=False):
         self.column_count = args[0]
         self.row_count = args[1]
-        self.action_size = (self.column_count * self.row_count) ** 2 + 1
+        # the full encoding has an action for every (from, to) pair of squares, the compact one only for every
+        # (from, offset) pair, which are the only moves that can ever be valid
+        self.compact_actions = compact_actions
+        if compact_actions:
+            self.action_size = self.column_count * self.row_count * len(self.OFFSETS) + 1
+        else:
+            self.action_size = (self.column_count * self.row_count) ** 2 + 1
+        self.build_move_tables()
+        # Zobrist keys of the pieces of player 1 and player -1 on every square, from a fixed seed so every process agrees
+        rng = np.random.default_rng(self.column_count * self.row_count)
+        self.zobrist = rng.integers(0, np.iinfo(np.uint64).max, size=(2, self.column_count * self.row_count), dtype=np.uint64, endpoint=True)
+
+    def build_move_tables(self):
+        # for every square and offset, the destination square (-1 if off the board) and the action of the move
+        squares = self.column_count * self.row_count
+        self.destinations = np.full((squares, len(self.OFFSETS)), -1, dtype=np.int64)
+        self.move_actions = np.full((squares, len(self.OFFSETS)), -1, dtype=np.int64)
+        # and the other way around, the start square, end square and kind of move of every action
+        self.action_from = np.full(self.action_size, -1, dtype=np.int64)
+        self.action_to = np.full(self.action_size, -1, dtype=np.int64)
+        self.action_jump = np.zeros(self.action_size, dtype=bool)
+        for a in range(self.column_count):
+            for b in range(self.row_count):
+                for k, (da, db) in enumerate(self.OFFSETS):
+                    a1, b1 = a + da, b + db
+                    if 0 <= a1 < self.column_count and 0 <= b1 < self.row_count:
+                        action = self.move_to_int((a, b, a1, b1))
+                        self.destinations[a*self.row_count + b][k] = a1*self.row_count + b1
+                        self.move_actions[a*self.row_count + b][k] = action
+                        self.action_from[action] = a*self.row_count + b
+                        self.action_to[action] = a1*self.row_count + b1
+                        self.action_jump[action] = abs(da) == 2 or abs(db) == 2
     
     def get_initial_state(self):
-        state = np.zeros((self.column_count, self.row_count))
+        state = np.zeros((self.column_count, self.row_count), dtype=np.int8)
         state[0][0] = 1
         state[self.column_count-1][self.row_count-1] = 1
         state[0][self.column_count-1] = -1
@@ -15,16 +50,73 @@ class Attaxx:
         return state
     
     def get_next_state(self, state, action, player):
+        self.play(state, action, player)
+        return state
+
+    def get_next_states(self, states, actions, players):
+        # plays one move on each board of a stack (N, S, S) at once, the pass action leaves its board as it is
+        # the stack is updated in place, as get_next_state() does with a board; the parallel self-play advances all its games with it
+        flat = np.asarray(states).reshape(len(states), -1)
+        actions = np.asarray(actions)
+        players = np.broadcast_to(np.asarray(players).reshape(-1), actions.shape)
+
+        moving = actions != self.action_size - 1
+        boards = np.flatnonzero(moving)
+        actions, players = actions[moving], players[moving]
+        start, end, jump = self.action_from[actions], self.action_to[actions], self.action_jump[actions]
+
+        flat[boards[jump], start[jump]] = 0
+        flat[boards, end] = players
+
+        # convert the opponent pieces among the 8 neighbours of the end square (-1 means off the board)
+        neighbours = self.destinations[end, :8]
+        rows = np.broadcast_to(boards[:, None], neighbours.shape)
+        owners = np.broadcast_to(players[:, None], neighbours.shape)
+        inside = neighbours >= 0
+        rows, neighbours, owners = rows[inside], neighbours[inside], owners[inside]
+        captured = flat[rows, neighbours] == -owners
+        flat[rows[captured], neighbours[captured]] = owners[captured]
+
+        return flat.reshape(np.shape(states))
+
+    def play(self, state, action, player, counts=None):
+        # plays the move in place and returns what undo() needs to take it back
+        # counts (see get_counts()) are kept up to date with the board when given
         if action == self.action_size - 1:
-            return state
+            return (action, player, [])
         move = self.int_to_move(action)
-        a, b, a1, b1 = move[0], move[1], move[2], move[3]
-        if abs(a-a1)==2 or abs(b-b1)==2:
+        a, b, a1, b1 = move
+        jump = abs(a-a1)==2 or abs(b-b1)==2
+        if jump:
             state[a][b] = 0
-            state[a1][b1] = player
-        else:
-            state[a1][b1] = player
-        self.capture_pieces(state, move, player)
+        state[a1][b1] = player
+
+        captured = self.capture_pieces(state, move, player)
+
+        if counts is not None:
+            if not jump:
+                counts[player] += 1
+                counts[0] -= 1
+            counts[player] += len(captured)
+            counts[-player] -= len(captured)
+        return (action, player, captured)
+
+    def undo(self, state, move, counts=None):
+        action, player, captured = move
+        if action == self.action_size - 1:
+            return state
+        a, b, a1, b1 = self.int_to_move(action)
+        for i, j in captured:
+            state[i][j] = -player
+        state[a1][b1] = 0
+        state[a][b] = player
+
+        if counts is not None:
+            if not self.action_jump[action]:
+                counts[player] -= 1
+                counts[0] += 1
+            counts[player] -= len(captured)
+            counts[-player] += len(captured)
         return state
 
     def is_valid_move(self, state, action, player):
@@ -36,53 +128,79 @@ class Attaxx:
         return True
 
     def capture_pieces(self, state, action, player):
+        # converts the opponent pieces around the end square and returns the converted squares
         a, b, a1, b1 = action
-        for i in range(a1-1, a1+2):
-            for j in range(b1-1, b1+2):
-                try:
-                    if state[i][j]==-player and i>=0 and j>=0:
-                        state[i][j] = player
-                except IndexError:
-                    pass
-                continue
+        captured = []
+        # clip the 3x3 neighbourhood to the board before indexing, negative indices would wrap around
+        for i in range(max(a1-1, 0), min(a1+2, self.column_count)):
+            for j in range(max(b1-1, 0), min(b1+2, self.row_count)):
+                if state[i][j]==-player:
+                    state[i][j] = player
+                    captured.append((i, j))
+        return captured
 
     def check_available_moves(self, state, player):
-        for i in range(self.column_count):
-            for j in range(self.row_count):
-                if state[i][j] == player:
-                    for a in range(self.column_count):
-                        for b in range(self.row_count):
-                            action = (i, j, a, b)
-                            if self.is_valid_move(state, action, player):
-                                return True
-        return False
+        return bool(np.any(self.get_valid_moves(state, player)))
 
     def move_to_int(self, move):
+        if self.compact_actions:
+            offset = self.OFFSETS.index((move[2] - move[0], move[3] - move[1]))
+            return (move[0]*self.row_count + move[1]) * len(self.OFFSETS) + offset
         return move[3] + move[2]*self.column_count + move[1]*self.column_count**2 + move[0]*self.column_count**3
 
+    def get_move_action(self, state, move, player):
+        # action of a move typed as (row, column, new row, new column), or None if it is not a valid move of the player
+        if len(move) != 4 or not all(0 <= x < self.column_count for x in move):
+            return None
+        try:
+            action = self.move_to_int(move)
+        except ValueError:
+            return None # compact actions: the destination is not a clone or jump away
+        return action if self.get_valid_moves(state, player)[action] else None
+
     def int_to_move(self, num):
+        if self.compact_actions:
+            square, offset = divmod(num, len(self.OFFSETS))
+            a, b = divmod(square, self.row_count)
+            return [a, b, a + self.OFFSETS[offset][0], b + self.OFFSETS[offset][1]]
         move = [(num // self.column_count**3) % self.column_count, 
                 (num // self.column_count**2) % self.column_count, 
                 (num // self.column_count) % self.column_count, 
                 num % self.column_count]
         return move
 
+    def get_full_actions(self):
+        # action of the full encoding for every compact action (-1 for moves off the board), used to convert old models
+        full = Attaxx([self.column_count, self.row_count])
+        actions = np.full(self.action_size, -1, dtype=np.int64)
+        for action in range(self.action_size - 1):
+            a, b, a1, b1 = self.int_to_move(action)
+            if 0 <= a1 < self.column_count and 0 <= b1 < self.row_count:
+                actions[action] = full.move_to_int((a, b, a1, b1))
+        actions[-1] = full.action_size - 1
+        return actions
+
     
     def get_valid_moves(self, state, player):
-        possible_moves = set()
+        # a move is valid if it starts on a piece of the player and ends on an empty square of the board
+        flat = np.asarray(state).reshape(-1)
+        empty = np.append(flat == 0, False) # destination -1 (off the board) reads this extra False
+        valid = (flat == player)[:, None] & empty[self.destinations]
 
-        for i in range(self.column_count):
-            for j in range(self.row_count):
-                state[i][j] = int(state[i][j])
-                if state[i][j] == player:
-                    moves_at_point = set(self.get_moves_at_point(state, player, i, j))
-                    possible_moves = possible_moves.union(moves_at_point)
-        
-        possible_moves_to_int = []
-        for move in possible_moves:
-            possible_moves_to_int.append(self.move_to_int(move))
-        binary_representation = [1 if i in possible_moves_to_int else 0 for i in range(self.action_size)]
+        binary_representation = np.zeros(self.action_size, dtype=np.int8)
+        binary_representation[self.move_actions[valid]] = 1
+        return binary_representation
+
+    def get_valid_moves_batch(self, states, players):
+        # same as get_valid_moves for a stack of boards (N, S, S) and a player per board, returns (N, action_size)
+        flat = np.asarray(states).reshape(len(states), -1)
+        empty = np.concatenate([flat == 0, np.zeros((len(flat), 1), dtype=bool)], axis=1)
+        own = flat == np.asarray(players).reshape(-1, 1)
+        valid = own[:, :, None] & empty[:, self.destinations]
 
+        boards, squares, offsets = np.nonzero(valid)
+        binary_representation = np.zeros((len(flat), self.action_size), dtype=np.int8)
+        binary_representation[boards, self.move_actions[squares, offsets]] = 1
         return binary_representation
 
     def get_moves_at_point(self, state, player, a, b):
@@ -94,31 +212,35 @@ class Attaxx:
                     moves_at_point.append(possible_action)
         return moves_at_point 
 
-    def check_board_full(self, state):
-        for row in state:
-            if 0 in row:
-                return False
-        
-        return True
+    def get_counts(self, state):
+        # number of empty squares and of pieces of each player, play() and undo() can keep them up to date
+        return {0: int(np.count_nonzero(state == 0)), 1: int(np.count_nonzero(state == 1)), -1: int(np.count_nonzero(state == -1))}
+
+    def get_hash(self, state):
+        # 64-bit Zobrist hash of the board, the XOR of the keys of its pieces
+        flat = np.asarray(state).reshape(-1)
+        return int(np.bitwise_xor.reduce(self.zobrist[0][flat == 1]) ^ np.bitwise_xor.reduce(self.zobrist[1][flat == -1]))
 
-    def check_win_and_over(self, state, action):
+    def check_board_full(self, state, counts=None):
+        if counts is None:
+            counts = self.get_counts(state)
+        return counts[0] == 0
+
+    def check_win_and_over(self, state, action, counts=None):
         # action não é necessário para o attaxx, mas é necessário para o go
+        # with counts the result comes straight from them, without looking at the board
 
-        count_player1 = 0
-        count_player2 = 0
+        if counts is None:
+            counts = self.get_counts(state)
+        count_player1 = counts[1]
+        count_player2 = counts[-1]
 
-        for i in range(self.column_count):
-            for j in range(self.row_count):
-                if state[i][j] == 1:
-                    count_player1+=1
-                elif state[i][j] == -1:
-                    count_player2+=1
         if count_player1 == 0:
             return -1, True
         elif count_player2 == 0:
             return 1, True
         
-        if self.check_board_full(state):
+        if self.check_board_full(state, counts):
             if count_player1>count_player2:
                 return 1, True
             elif count_player2>count_player1:
@@ -127,11 +249,28 @@ class Attaxx:
                 return 2, True
         
         return 0, False
-    
-    def get_value_and_terminated(self, state, action, player):
-        winner, game_over = self.check_win_and_over(state, action = None)
+
+    def check_win_and_over_batch(self, states):
+        # same as check_win_and_over for a stack of boards (N, S, S), returns the arrays (winner, game_over)
+        states = np.asarray(states)
+        count_player1 = np.count_nonzero(states == 1, axis=(1, 2))
+        count_player2 = np.count_nonzero(states == -1, axis=(1, 2))
+        full = np.count_nonzero(states == 0, axis=(1, 2)) == 0
+
+        winner = np.where(full, np.sign(count_player1 - count_player2), 0)
+        winner = np.where(full & (count_player1 == count_player2), 2, winner)
+        winner = np.where(count_player2 == 0, 1, winner)
+        winner = np.where(count_player1 == 0, -1, winner)
+        game_over = full | (count_player1 == 0) | (count_player2 == 0)
         return winner, game_over
     
+    def get_value_and_terminated(self, state, action, player, counts=None):
+        # value for the player who made the last move: 1 if they won, -1 if they lost and 0 for a draw or an ongoing game
+        winner, game_over = self.check_win_and_over(state, action = None, counts = counts)
+        if winner == 2:
+            return 0, game_over
+        return winner * player, game_over
+    
     def print_board(self, state):
         state = state.astype(int)
         # Print column coordinates
@@ -151,11 +290,8 @@ class Attaxx:
             print()
 
     def get_encoded_state(self, state):
-        layer_1 = np.where(np.array(state) == -1, 1, 0).astype(np.float32) #returns same sized board replacing all -1 with 1 and all other positions with 0
-        layer_2 = np.where(np.array(state) == 0, 1, 0).astype(np.float32) #same logic for each possible number in position (-1, 1, or 0)
-        layer_3 = np.where(np.array(state) == 1, 1, 0).astype(np.float32)
-        
-        result = np.stack([layer_1, layer_2, layer_3]).astype(np.float32) #encoded state
+        state = np.asarray(state)
+        result = np.stack([state == -1, state == 0, state == 1], axis=-3).astype(np.float32) #one plane per value (-1, 0 or 1), works for a single board or a stack of boards
         
         return result
 
@@ -166,4 +302,165 @@ class Attaxx:
         return -value
 
     def change_perspective(self, state, player):
-        return state * player 
+        return (state * np.int8(player)).astype(np.int8, copy=False)
+
+    def get_solver(self, args):
+        # exact solver for the MCTS leaves with at most args['solver_empties'] empty squares, None when it is disabled
+        if args.get('solver_empties', 0) > 0:
+            return AttaxxSolver(self, args.get('solver_max_nodes', 2000))
+        return None
+
+
+class AttaxxSolver:
+    # exact negamax search with alpha-beta pruning for positions with few empty squares
+    # values are 1 / 0 / -1 for a win / draw / loss of the player to move, and results are kept in a transposition table
+    # a position with no moves for both players is scored on its pieces, and a position repeating on the current line
+    # (jumps can go back and forth) is scored as a draw; such a value depends on the line, so results that used it are
+    # not kept in the table
+    # lines longer than max_depth are left unknown: a position is still solved if a known line wins or all its lines are known
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, game, max_nodes=2000, max_depth=24, table_size=1000000):
+        self.game = game
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.table = {}
+        self.unsolved = set()
+        self.nodes = 0
+        self.repetitions = 0
+
+        # for every square, the squares a clone or a jump onto it can come from (the neighbours are also the captured squares)
+        squares = game.column_count * game.row_count
+        self.neighbours = [[] for _ in range(squares)]
+        self.jump_sources = [[] for _ in range(squares)]
+        for square in range(squares):
+            for k, destination in enumerate(game.destinations[square]):
+                if destination == -1:
+                    continue
+                if k < 8:
+                    self.neighbours[destination].append(square)
+                else:
+                    self.jump_sources[destination].append(square)
+
+    def solve(self, state, player, counts=None):
+        # returns the exact value of the board for the player to move, or None if it takes more than max_nodes positions
+        # the positions that could not be solved are remembered, so they are not tried again
+        key = state.tobytes() + bytes([player + 1])
+        if key in self.unsolved:
+            return None
+        if counts is None:
+            counts = self.game.get_counts(state)
+        if len(self.table) > self.table_size:
+            self.table.clear()
+            self.unsolved.clear()
+        self.nodes = 0
+        value = self.negamax(state.reshape(-1).tolist(), player, dict(counts), False, -1, 1, set(), 0)
+        if value is None:
+            self.unsolved.add(key)
+        return value
+
+    def negamax(self, board, player, counts, passed, alpha, beta, line, depth):
+        if counts[player] == 0:
+            return -1
+        if counts[-player] == 0:
+            return 1
+        if counts[0] == 0:
+            return (counts[player] > counts[-player]) - (counts[player] < counts[-player])
+
+        key = bytes([piece + 1 for piece in board] + [player + 1, passed])
+        if key in line:
+            self.repetitions += 1
+            return 0
+        entry = self.table.get(key)
+        if entry is not None:
+            value, flag = entry
+            if flag == self.EXACT:
+                return value
+            if flag == self.LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        self.nodes += 1
+        if self.nodes > self.max_nodes or depth > self.max_depth:
+            return None
+
+        # all the clones onto a square give the same position, so only one per square is tried
+        moves = []
+        for square, piece in enumerate(board):
+            if piece != 0:
+                continue
+            captures = sum(1 for neighbour in self.neighbours[square] if board[neighbour] == -player)
+            if any(board[neighbour] == player for neighbour in self.neighbours[square]):
+                moves.append((captures + 1, square, -1))
+            for source in self.jump_sources[square]:
+                if board[source] == player:
+                    moves.append((captures, square, source))
+
+        if len(moves) == 0:
+            if passed:
+                return (counts[player] > counts[-player]) - (counts[player] < counts[-player])
+            line.add(key)
+            value = self.negamax(board, -player, counts, True, -beta, -alpha, line, depth + 1)
+            line.discard(key)
+            return None if value is None else -value
+
+        # the moves that win the most pieces first
+        moves.sort(reverse=True)
+        original_alpha = alpha
+        repetitions = self.repetitions
+        best = -2
+        unknown = False
+        line.add(key)
+        for _, square, source in moves:
+            captured = [neighbour for neighbour in self.neighbours[square] if board[neighbour] == -player]
+            board[square] = player
+            if source == -1:
+                counts[player] += 1
+                counts[0] -= 1
+            else:
+                board[source] = 0
+            for neighbour in captured:
+                board[neighbour] = player
+            counts[player] += len(captured)
+            counts[-player] -= len(captured)
+
+            value = self.negamax(board, -player, counts, False, -beta, -alpha, line, depth + 1)
+
+            for neighbour in captured:
+                board[neighbour] = -player
+            counts[player] -= len(captured)
+            counts[-player] += len(captured)
+            board[square] = 0
+            if source == -1:
+                counts[player] -= 1
+                counts[0] += 1
+            else:
+                board[source] = player
+
+            if value is None:
+                if self.nodes > self.max_nodes:
+                    line.discard(key)
+                    return None
+                unknown = True
+                continue
+            best = max(best, -value)
+            alpha = max(alpha, best)
+            if alpha >= beta:
+                break
+        line.discard(key)
+
+        if unknown and best < beta:
+            return None
+        if self.repetitions != repetitions:
+            return best
+        if best <= original_alpha:
+            self.table[key] = (best, self.UPPER)
+        elif best >= beta:
+            self.table[key] = (best, self.LOWER)
+        else:
+            self.table[key] = (best, self.EXACT)
+        return best
@@ -8,11 +8,16 @@ class Go():
     WHITEMARKER = 5
     LIBERTY = 8
 
-    def __init__(self, size, komi):
+    DIRECTIONS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+    def __init__(self, size=9, komi=5.5, scoring_mode='influence'):
         self.row_count = size
         self.column_count = size
-        self.komi = 5.5
+        self.komi = komi
+        self.scoring_mode = scoring_mode
+        self.neighbours = GoPosition.get_neighbours(size)
         self.action_size = self.row_count * self.column_count + 1
+        self.zobrist = np.array([GoPosition.get_zobrist(size)[self.BLACK], GoPosition.get_zobrist(size)[self.WHITE]], dtype=np.uint64)
         self.liberties = []
         self.block = []
         self.seki_liberties = []
@@ -21,11 +26,12 @@ class Go():
         '''
         # Description:
         Returns a board of the argument size filled of zeros.
+        Boards are int8 arrays, one byte per point, since they only hold -1, 0 and 1.
 
         # Retuns:
         Empty board full of zeros
         '''
-        board = np.zeros((self.row_count, self.column_count))
+        board = np.zeros((self.row_count, self.column_count), dtype=np.int8)
         return board
     
 
@@ -198,98 +204,272 @@ class Go():
         state[a][b] = player
         return state
     
-    def get_next_state(self, state, action, player):
+    def get_next_state(self, state, action, player, history=None, position=None):
         '''
         # Description
         Plays the move, verifies and undergoes captures and saves the state to the history.
+        The history is an optional set with the hashes of the previous positions of the game (see get_hash()).
+        The position is the GoPosition kept with the board of the game (see get_position()), if there is one.
+        The hash added to the history is the one play() updated with the stone and the captures.
         
         # Returns:
         New state with everything updated.
         '''
-        if action == self.row_count * self.column_count:
-            return state # pass move
+        move = self.play(state, action, player, position)
+        if history is not None:
+            history.add(move[3])
+        return state
+
+    def get_position(self, state):
+        '''
+        # Description:
+        Builds the GoPosition that follows the given board: the board of a game or a working board of the search.
+        Once built, play() and undo() with the position keep it up to date with the board.
 
-        a = action // self.row_count
-        b = action % self.column_count
+        # Returns:
+        The GoPosition of the board.
+        '''
+        return GoPosition(state)
 
-        # checking if the move is part of is the secondary move to a ko fight
-        state = self.set_stone(a, b, state, player)
-        # print(state)
-        state = self.captures(state, -player, a, b)[1]
+    def play(self, state, action, player, position=None):
+        '''
+        # Description:
+        Plays the move on the board in place and removes the opponent chains it captures.
+        With the position of the board (see get_position()), only the neighbours of the stone and the captured chains
+        are touched; without it, a position is built for the board first.
+        THIS DOES NOT check the legality of the move, use get_valid_moves().
+
+        # Returns:
+        Tuple (action, player, captured, hash, changes) with everything undo() needs to take the move back
+        (see GoPosition.play()).
+        '''
+        if position is None:
+            position = GoPosition(state)
+        return position.play(action, player)
+
+    def undo(self, state, move, position=None):
+        '''
+        # Description:
+        Takes back a move made with play(): removes the stone and puts the captured stones back.
+        A move played with a position has to be taken back with the same position.
+
+        # Returns:
+        The board as it was before the move.
+        '''
+        if position is not None:
+            position.undo(move)
+            return state
+
+        action, player, captured = move[:3]
+        if action == self.row_count * self.column_count:
+            return state
+
+        flat = state.reshape(-1)
+        flat[action] = self.EMPTY
+        flat[captured] = -player
         return state
+
+    def get_chain(self, flat, point):
+        '''
+        # Description:
+        Follows the chain of the stone at the given point, without looking at the rest of the board.
+
+        # Returns:
+        Tuple (stones, liberties) with the points of the chain and the set of its liberties.
+        '''
+        colour = flat[point]
+        stones = [point]
+        seen = {point}
+        liberties = set()
+        i = 0
+        while i < len(stones):
+            for neighbour in self.neighbours[stones[i]]:
+                if flat[neighbour] == self.EMPTY:
+                    liberties.add(neighbour)
+                elif flat[neighbour] == colour and neighbour not in seen:
+                    seen.add(neighbour)
+                    stones.append(neighbour)
+            i += 1
+        return stones, liberties
     
-    def is_valid_move(self, state: list, action: tuple, player: int) -> bool:
+    def is_valid_move(self, state: list, action: tuple, player: int, history: set = None, position=None) -> bool:
         '''
         # Description:
         Checks if a move is valid.
         If a move repeats a previous state or commits suicide (gets captured without capturing back), it is not valid.
-        
-        A print will follow explaining the invalid move in case it exists.
+        With the position of the board only the chains next to the point are looked at (see GoPosition.is_legal()),
+        without it they are followed on the board.
 
         # Returns:
         A boolean confirming the validity of the move.
         '''
+        point = action[0] * self.column_count + action[1]
+        if position is not None:
+            return position.is_legal(point, player, history)
 
-        a = action[0]
-        b = action[1]
+        flat = np.asarray(state).reshape(-1)
+        if flat[point] != self.EMPTY:
+            return False
 
-        #print(f"{a} , {b}")
+        legal = False
+        captured = set()
+        for neighbour in self.neighbours[point]:
+            if flat[neighbour] == self.EMPTY:
+                legal = True
+            elif neighbour not in captured:
+                stones, liberties = self.get_chain(flat, neighbour)
+                if flat[neighbour] == player and len(liberties) > 1:
+                    legal = True
+                elif flat[neighbour] == -player and len(liberties) == 1:
+                    legal = True
+                    captured.update(stones)
 
-        statecopy = np.copy(state).astype(np.int8)
+        if not legal or not history:
+            return legal
 
-        if state[a][b] != self.EMPTY:
-            # print("Space Occupied")
-            return False 
+        colour = 0 if player == self.BLACK else 1
+        new_hash = self.get_hash(state) ^ int(self.zobrist[colour][point]) ^ int(np.bitwise_xor.reduce(self.zobrist[1 - colour][list(captured)]))
+        return new_hash not in history
 
+    def get_valid_moves(self, state, player, history=None, position=None):
+        '''
+        # Description:
+        Returns a matrix with the valid moves for the current player.
+        If the hashes of the previous positions are given as history, moves that repeat one of them are not valid.
+        With the position of the board (see get_position()) the chains are not built again.
+        '''
+        if position is None:
+            position = GoPosition(state)
+        size = self.row_count * self.column_count
 
-        statecopy = self.set_stone(a,b,statecopy,player)
+        valid_moves = np.zeros(size + 1, dtype=np.int8)
+        for point in np.flatnonzero(position.flat == self.EMPTY):
+            if position.is_legal(point, player, history):
+                valid_moves[point] = 1
 
-        if self.captures(statecopy, -player, a, b)[0] == True:
-            return True
-        else:
-            #print("no captures")
-            libs, block = self.count(b,a,statecopy,player,[],[])
-            #print(libs)
-            if len(libs) == 0:
-                #print("Invalid, Suicide")
-                return False
-            else:
-                return True
-        
+        # the skip is only valid in the endgame, when less than 1/4 of the board is empty
+        valid_moves[-1] = position.counts[self.EMPTY] < size // 4
+        return valid_moves
 
-    def get_valid_moves(self, state, player):
+    def get_hash(self, state):
         '''
         # Description:
-        Returns a matrix with the valid moves for the current player.
+        Computes the 64-bit Zobrist hash of a board from scratch, the same key GoPosition keeps up to date incrementally
+        on every placement and capture. It identifies a position compactly, for the superko history or as a key for caches.
+        Where a GoPosition follows the board, its hash is used instead of computing this one.
+
+        # Returns:
+        Integer with the hash of the board.
         '''
-        newstate = np.zeros((self.row_count, self.column_count))
-        for a in range(0, self.column_count):
-            for b in range(0, self.row_count):
-                if self.is_valid_move(state, (a,b), player):
-                    newstate[a][b] = 1
-        
-        newstate = newstate.reshape(-1)
+        flat = np.asarray(state).reshape(-1)
+        return int(np.bitwise_xor.reduce(self.zobrist[0][flat == self.BLACK]) ^ np.bitwise_xor.reduce(self.zobrist[1][flat == self.WHITE]))
 
-        empty = 0
-        endgame = True
-        
-        for x in range(self.column_count):
-            for y in range(self.row_count):
-                if state[x][y] == self.EMPTY:
-                    empty += 1
-                    if empty >= self.column_count * self.row_count // 4: # if more than 1/4 of the board is empty, it is not the endgame
-                        endgame = False
-                        break
-        if endgame:
-            newstate = np.concatenate([newstate, [1]])
-        else:
-            newstate = np.concatenate([newstate, [0]])
-        return (newstate).astype(np.int8)
+    def shift_boards(self, states, dy, dx, fill):
+        '''
+        # Description:
+        Shifts a stack of boards so that each point holds the value of its neighbour at (y+dy, x+dx).
+        Points whose neighbour falls outside the board are filled with the given value.
+
+        # Returns:
+        Array with the same shape as the input.
+        '''
+        shifted = np.full_like(states, fill)
+        rows, columns = self.row_count, self.column_count
+        shifted[:, max(-dy, 0):rows - max(dy, 0), max(-dx, 0):columns - max(dx, 0)] = \
+            states[:, max(dy, 0):rows - max(-dy, 0), max(dx, 0):columns - max(-dx, 0)]
+        return shifted
+
+    def label_regions(self, states):
+        '''
+        # Description:
+        Labels the connected regions of equal points (chains of stones and regions of empty points) of a stack of boards.
+        Every point starts with its own flat index as label, then labels are propagated with the minimum of the
+        orthogonal neighbours of the same colour and shortcut by pointer jumping until nothing changes.
+
+        # Returns:
+        Array of shape (N, S, S) with the smallest flat index of each region, unique across the whole stack.
+        '''
+        n = len(states)
+        size = self.row_count * self.column_count
+        labels = np.arange(n * size).reshape(n, self.row_count, self.column_count)
+
+        same = [self.shift_boards(states, dy, dx, 2) == states for dy, dx in self.DIRECTIONS]
+
+        while True:
+            new_labels = labels
+            for (dy, dx), mask in zip(self.DIRECTIONS, same):
+                neighbour = self.shift_boards(labels, dy, dx, n * size)
+                new_labels = np.where(mask, np.minimum(new_labels, neighbour), new_labels)
+            new_labels = new_labels.reshape(-1)[new_labels]
+            if np.array_equal(new_labels, labels):
+                return labels
+            labels = new_labels
+
+    def count_liberties_batch(self, states, labels):
+        '''
+        # Description:
+        Counts the liberties of every chain of a stack of boards, each empty point being counted once per chain.
+
+        # Returns:
+        Array indexed by region label with the number of liberties of that chain.
+        '''
+        total = labels.size
+        empty = (states == self.EMPTY).reshape(-1)
+        points = np.arange(total).reshape(states.shape)
+
+        keys = []
+        for dy, dx in self.DIRECTIONS:
+            neighbour = self.shift_boards(points, dy, dx, -1).reshape(-1)
+            stones = (neighbour >= 0) & empty
+            stones[stones] = states.reshape(-1)[neighbour[stones]] != self.EMPTY
+            keys.append(labels.reshape(-1)[neighbour[stones]] * total + np.flatnonzero(stones))
+
+        keys = np.unique(np.concatenate(keys))
+        return np.bincount(keys // total, minlength=total)
+
+    def get_valid_moves_batch(self, states, players, captures=False):
+        '''
+        # Description:
+        Returns the valid moves of a stack of boards in one go, without looping over the points in Python.
+        A point is valid if it is empty and it touches an empty point, a chain of the player with more than one
+        liberty or a chain of the opponent in atari. The skip follows the same endgame rule as get_valid_moves().
+        Superko is not checked, as the boards come without their history.
+
+        # Returns:
+        Array of shape (N, S*S+1) with the valid moves of each board.
+        With captures, also a boolean array of shape (N, S*S) with the valid moves that capture a chain of the opponent.
+        '''
+        states = np.asarray(states)
+        players = np.asarray(players).reshape(-1, 1, 1)
+
+        labels = self.label_regions(states)
+        liberties = self.count_liberties_batch(states, labels)
+        relative = states * players
+
+        empty = relative == self.EMPTY
+        valid = np.zeros(states.shape, dtype=bool)
+        capturing = np.zeros(states.shape, dtype=bool)
+        for dy, dx in self.DIRECTIONS:
+            colour = self.shift_boards(relative, dy, dx, 2)
+            libs = liberties[self.shift_boards(labels, dy, dx, 0)]
+            capturing |= (colour == -1) & (libs == 1)
+            valid |= (colour == self.EMPTY) | ((colour == 1) & (libs > 1))
+        valid |= capturing
+        valid &= empty
+
+        size = self.row_count * self.column_count
+        endgame = np.sum(empty, axis=(1, 2)) < size // 4
 
-    def get_value_and_terminated(self, state, action, player):
+        valid_moves = np.concatenate([valid.reshape(-1, size), endgame.reshape(-1, 1)], axis=1).astype(np.int8)
+        if captures:
+            return valid_moves, (capturing & empty).reshape(-1, size)
+        return valid_moves
+
+    def get_value_and_terminated(self, state, action, player, position=None):
         '''
         # Description:
         Returns the value of the state and if the game is over.
+        The position is accepted so the search can call it with the same arguments as play(), the score does not need it.
         '''
 
         scoring, endgame = self.scoring(state)
@@ -326,72 +506,81 @@ class Go():
 
         black - (white + komi)
 
+        where black and white are counted with the scoring mode of the game (see count_territory_batch()).
+
         # Returns:
         Integer with score.
         '''
-        black = 0
-        white = 0
-        empty = 0
-        endgame = True
-
-        for x in range(self.column_count):
-            for y in range(self.row_count):
-                if state[x][y] == self.EMPTY:
-                    empty += 1
-                    if empty >= self.column_count * self.row_count // 6:
-                        endgame = False
-                        break
-
-        black, white = self.count_influenced_territory_enhanced(state)
-                            
+        scores, endgame = self.scoring_batch(np.asarray(state)[np.newaxis])
+        return scores[0], bool(endgame[0])
+
+    def scoring_batch(self, states, mode=None):
+        '''
+        # Description:
+        Scores a stack of boards at once with black - (white + komi).
+        A board is in the endgame when less than 1/6 of its points are empty.
+
+        # Returns:
+        Tuple (scores, endgame) with one entry per board.
+        '''
+        black, white = self.count_territory_batch(states, mode)
+        empty = np.sum(states == self.EMPTY, axis=(1, 2))
+        endgame = empty < self.column_count * self.row_count // 6
         return black - (white + self.komi), endgame
+
+    def count_territory_batch(self, states, mode=None):
+        '''
+        # Description:
+        Counts the points of black and white for a stack of boards with array operations.
+        There are two modes:
+        - 'influence': an empty point belongs to the colour with more stones among its four neighbours.
+        - 'area': empty regions touching only one colour belong to that colour, and every stone counts as a point
+          for its colour (area scoring). Regions touching both colours are neutral.
+        Without a mode, the scoring mode of the game is used.
+
+        # Returns:
+        Tuple (black, white) of arrays with the points of each board.
+        '''
+        states = np.asarray(states)
+        mode = mode or self.scoring_mode
+        empty = states == self.EMPTY
+
+        if mode == 'influence':
+            influence = sum(self.shift_boards(states.astype(np.int8), dy, dx, 0) for dy, dx in self.DIRECTIONS)
+            black = np.sum(empty & (influence > 0), axis=(1, 2))
+            white = np.sum(empty & (influence < 0), axis=(1, 2))
+            return black, white
+
+        if mode == 'area':
+            labels = self.label_regions(states)
+            touches = {}
+            for colour in [self.BLACK, self.WHITE]:
+                regions = np.zeros(labels.size, dtype=bool)
+                for dy, dx in self.DIRECTIONS:
+                    border = empty & (self.shift_boards(states, dy, dx, self.EMPTY) == colour)
+                    regions[labels[border]] = True
+                touches[colour] = regions[labels]
+
+            black_area = (states == self.BLACK) | (empty & touches[self.BLACK] & ~touches[self.WHITE])
+            white_area = (states == self.WHITE) | (empty & touches[self.WHITE] & ~touches[self.BLACK])
+            return np.sum(black_area, axis=(1, 2)), np.sum(white_area, axis=(1, 2))
+
+        raise ValueError(f"Unknown scoring mode: {mode}")
     
     def count_influenced_territory_enhanced(self, board: list) -> tuple[int, int]:
         '''
         # Description 
         Calculates the territory influenced by black and white players on the Go board.
 
-        This function iterates through the board, analyzing each empty point to determine 
-        if it's influenced by the surrounding black or white stones. The influence is calculated
-        based on the adjacent stones, with positive scores indicating black influence and negative
-        scores indicating white influence.
+        Each empty point is analysed to determine if it's influenced by the surrounding black or white stones.
+        The influence is calculated based on the adjacent stones, with positive scores indicating black influence
+        and negative scores indicating white influence.
 
         # Returns:
         Tuple (black_territory, white_territory)
         '''
-        black_territory = 0
-        white_territory = 0
-        visited = set()
-
-        # Function to calculate influence score
-        def influence_score(x, y):
-            score = 0
-            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < len(board) and 0 <= ny < len(board[0]):
-                    score += board[nx][ny]
-            return score
-
-        # Function to explore territory
-        def explore_territory(x, y):
-            nonlocal black_territory, white_territory
-            if (x, y) in visited or not (0 <= x < len(board) and 0 <= y < len(board[0])):
-                return
-            visited.add((x, y))
-
-            if board[x][y] == 0:
-                score = influence_score(x, y)
-                if score > 0:
-                    black_territory += 1
-                elif score < 0:
-                    white_territory += 1
-
-        for i in range(len(board)):
-            for j in range(len(board[0])):
-                if board[i][j] == 0 and (i, j) not in visited:
-                    explore_territory(i, j)
-
-        return black_territory, white_territory
+        black, white = self.count_territory_batch(np.asarray(board)[np.newaxis], 'influence')
+        return int(black[0]), int(white[0])
 
 
     def get_opponent(self, player):
@@ -418,14 +607,13 @@ class Go():
         - Layer 3 encodes the positions of black stones (represented by 1 in the input state) as 1s, and all other positions as 0s.
         This encoding helps in clearly distinguishing between different elements on the board for machine learning applications.
 
+        A stack of boards of shape (N, height, width) is encoded as (N, 3, height, width).
+
         # Returns: 
         A NumPy array of shape (3, height, width) containing the 3-layer encoded representation of the board state. Each layer is a 2D array where the board's height and width correspond to the dimensions of the original state.
         '''
-        layer_1 = np.where(np.array(state) == -1, 1, 0).astype(np.float32)
-        layer_2 = np.where(np.array(state) == 0, 1, 0).astype(np.float32)
-        layer_3 = np.where(np.array(state) == 1, 1, 0).astype(np.float32)
-
-        result = np.stack([layer_1, layer_2, layer_3]).astype(np.float32)
+        state = np.asarray(state)
+        result = np.stack([state == -1, state == 0, state == 1], axis=-3).astype(np.float32)
 
         return result
     
@@ -437,4 +625,348 @@ class Go():
         # Returns: 
         A two-dimensional array representing the Go board state adjusted for the current player's perspective.
         '''
-        return state * player
\ No newline at end of file
+        return (state * np.int8(player)).astype(np.int8, copy=False)
+
+    def get_solver(self, args):
+        '''
+        # Description:
+        Returns the exact solver MCTS uses for positions close to the end of the game.
+        Go has no such solver.
+        '''
+        return None
+
+class GoPosition():
+    '''
+    # GoPosition
+    ## Description:
+        A Go position that keeps its chains up to date incrementally as stones are placed and captured.
+        Every stone points to a parent stone of the same chain (union-find by size, without path compression so
+        that merges can be undone), and the root of each chain stores the stones of the chain, the set of its
+        liberties and the Zobrist hash of its stones. Placing a stone only touches its four neighbours and the
+        chains it captures, so capture and suicide checks are O(1) amortised instead of a flood fill of the board.
+
+        The position works on the board it is given, so playing or undoing a move also updates that board.
+        A position is built once for each game and each working board of the search, and follows it with
+        play() and undo() instead of being built again for every move.
+
+        The position also keeps the 64-bit Zobrist hash of the board and the number of empty points and of
+        stones of each colour, updated on every placement and capture.
+    ## Methods:
+        - `is_legal()`: Checks if a stone can be placed on a point, optionally against a history of hashes (positional superko).
+        - `play()`: Places a stone, merges chains and removes captured stones.
+        - `undo()`: Takes back a move made with play().
+        - `liberties()`: Returns the liberties of the chain at a point.
+    '''
+
+    neighbour_tables = {}
+    zobrist_tables = {}
+    ZOBRIST_SEED = 19
+
+    def __init__(self, board):
+        self.size = len(board)
+        self.board = board
+        self.flat = board.reshape(-1)
+        self.neighbours = GoPosition.get_neighbours(self.size)
+        self.zobrist = GoPosition.get_zobrist(self.size)
+
+        self.parent = [-1] * (self.size * self.size)
+        self.stones = {}
+        self.chain_liberties = {}
+        self.chain_hash = {}
+        self.hash = 0
+        self.counts = {Go.EMPTY: self.size * self.size, Go.BLACK: 0, Go.WHITE: 0}
+
+        for point in range(self.size * self.size):
+            colour = int(self.flat[point])
+            if colour == Go.EMPTY:
+                continue
+
+            self.parent[point] = point
+            self.stones[point] = [point]
+            self.chain_liberties[point] = set()
+            self.chain_hash[point] = self.zobrist[colour][point]
+            self.hash ^= self.zobrist[colour][point]
+            self.counts[colour] += 1
+            self.counts[Go.EMPTY] -= 1
+
+            for neighbour in self.neighbours[point]:
+                if self.flat[neighbour] == Go.EMPTY:
+                    self.liberties(point).add(neighbour)
+                elif neighbour < point and self.flat[neighbour] == colour:
+                    self.union(point, neighbour)
+
+    @staticmethod
+    def get_neighbours(size):
+        '''
+        # Description:
+        Returns, for every point of a board of the given size, the flat indices of its orthogonal neighbours.
+        The tables are built once per board size and shared by every position.
+
+        # Returns:
+        List of tuples with the neighbours of each point.
+        '''
+        if size not in GoPosition.neighbour_tables:
+            table = []
+            for point in range(size * size):
+                y, x = divmod(point, size)
+                neighbours = []
+                if y > 0: neighbours.append(point - size)
+                if x < size - 1: neighbours.append(point + 1)
+                if y < size - 1: neighbours.append(point + size)
+                if x > 0: neighbours.append(point - 1)
+                table.append(tuple(neighbours))
+            GoPosition.neighbour_tables[size] = table
+        return GoPosition.neighbour_tables[size]
+
+    @staticmethod
+    def get_zobrist(size):
+        '''
+        # Description:
+        Returns the Zobrist keys of a board of the given size: one random 64-bit integer per point and colour.
+        The keys come from a fixed seed, so every process builds the same keys and hashes can be shared between them.
+
+        # Returns:
+        Dictionary from colour (BLACK/WHITE) to the list of keys of each point.
+        '''
+        if size not in GoPosition.zobrist_tables:
+            rng = np.random.default_rng(GoPosition.ZOBRIST_SEED + size)
+            keys = rng.integers(0, np.iinfo(np.uint64).max, size=(2, size * size), dtype=np.uint64, endpoint=True)
+            GoPosition.zobrist_tables[size] = {Go.BLACK: [int(key) for key in keys[0]], Go.WHITE: [int(key) for key in keys[1]]}
+        return GoPosition.zobrist_tables[size]
+
+    def find(self, point):
+        '''
+        # Description:
+        Finds the root stone of the chain of a point. The union by size keeps the chains shallow.
+
+        # Returns:
+        Index of the root stone.
+        '''
+        parent = self.parent
+        while parent[point] != point:
+            point = parent[point]
+        return point
+
+    def union(self, a, b):
+        '''
+        # Description:
+        Merges the chains of two stones of the same colour. The smaller chain is merged into the larger one.
+
+        # Returns:
+        Root of the merged chain.
+        '''
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if len(self.stones[a]) < len(self.stones[b]):
+            a, b = b, a
+
+        self.parent[b] = a
+        self.stones[a] += self.stones.pop(b)
+        self.chain_liberties[a] |= self.chain_liberties.pop(b)
+        self.chain_hash[a] ^= self.chain_hash.pop(b)
+        return a
+
+    def liberties(self, point):
+        '''
+        # Description:
+        Returns the liberties of the chain that contains the stone at the given point.
+        '''
+        return self.chain_liberties[self.find(point)]
+
+    def is_legal(self, point, player, history=None):
+        '''
+        # Description:
+        Checks if the player can place a stone on the point without committing suicide.
+        A move is legal if the point is empty and the stone ends with a liberty, either because it touches an empty
+        point, joins a chain with another liberty or captures an opponent chain.
+        With a history (a set of hashes, see Go.get_hash()), the move is also illegal if the resulting position is already in it.
+
+        # Returns:
+        A boolean confirming the legality of the move.
+        '''
+        if self.flat[point] != Go.EMPTY:
+            return False
+
+        legal = False
+        captured = set()
+        for neighbour in self.neighbours[point]:
+            colour = self.flat[neighbour]
+            if colour == Go.EMPTY:
+                legal = True
+                continue
+            root = self.find(neighbour)
+            libs = len(self.chain_liberties[root])
+            if colour == player and libs > 1:
+                legal = True
+            elif colour == -player and libs == 1:
+                legal = True
+                captured.add(root)
+
+        if not legal or not history:
+            return legal
+        return self.get_move_hash(point, player, captured) not in history
+
+    def get_move_hash(self, point, player, captured=None):
+        '''
+        # Description:
+        Computes the Zobrist hash of the position after the player places a stone on the point, without playing it:
+        the key of the stone and the hashes of the opponent chains it captures are XORed into the hash of the position.
+        The roots of the captured chains can be given if they are already known.
+
+        # Returns:
+        Integer with the hash of the new position.
+        '''
+        if captured is None:
+            captured = {self.find(neighbour) for neighbour in self.neighbours[point]
+                        if self.flat[neighbour] == -player and len(self.liberties(neighbour)) == 1}
+
+        new_hash = self.hash ^ self.zobrist[player][point]
+        for root in captured:
+            new_hash ^= self.chain_hash[root]
+        return new_hash
+
+    def play(self, point, player):
+        '''
+        # Description:
+        Places a stone of the player on the point and updates chains, liberties, hash, counts and the board.
+        Opponent chains left without liberties are removed. THIS DOES NOT check the legality of the move, use is_legal().
+        The pass (the point after the last one) changes nothing.
+
+        # Returns:
+        Tuple (point, player, captured, hash, changes): the points of the captured stones, the hash of the new position
+        and what undo() needs to restore the chains.
+        '''
+        if point == self.size * self.size:
+            return (point, player, [], self.hash, None)
+
+        previous_hash = self.hash
+        key = self.zobrist[player][point]
+        self.flat[point] = player
+        self.hash ^= key
+        self.counts[Go.EMPTY] -= 1
+        self.counts[player] += 1
+
+        friends = []
+        enemies = []
+        for neighbour in self.neighbours[point]:
+            colour = self.flat[neighbour]
+            if colour == Go.EMPTY:
+                continue
+            root = self.find(neighbour)
+            if colour == player and root not in friends:
+                friends.append(root)
+            elif colour == -player and root not in enemies:
+                enemies.append(root)
+
+        # the stone joins the largest friendly chain, which gets a new liberty set so its old one is kept for undo()
+        liberties = {neighbour for neighbour in self.neighbours[point] if self.flat[neighbour] == Go.EMPTY}
+        if len(friends) == 0:
+            root = point
+            merged = None
+            self.stones[root] = []
+            self.chain_hash[root] = 0
+        else:
+            root = max(friends, key=lambda friend: len(self.stones[friend]))
+            merged = (root, len(self.stones[root]), self.chain_liberties[root], self.chain_hash[root], [])
+            liberties |= self.chain_liberties[root]
+            for friend in friends:
+                if friend == root:
+                    continue
+                merged[4].append((friend, self.stones.pop(friend), self.chain_liberties.pop(friend), self.chain_hash.pop(friend)))
+                self.parent[friend] = root
+                self.stones[root] += merged[4][-1][1]
+                liberties |= merged[4][-1][2]
+                self.chain_hash[root] ^= merged[4][-1][3]
+        liberties.discard(point)
+        self.parent[point] = root
+        self.stones[root].append(point)
+        self.chain_liberties[root] = liberties
+        self.chain_hash[root] ^= key
+
+        captured = []
+        removed = []
+        for enemy in enemies:
+            self.chain_liberties[enemy].discard(point)
+            if len(self.chain_liberties[enemy]) == 0:
+                removed.append(self.remove_chain(enemy))
+                captured += removed[-1][1]
+
+        return (point, player, captured, self.hash, (previous_hash, merged, enemies, removed))
+
+    def remove_chain(self, root):
+        '''
+        # Description:
+        Removes a captured chain from the board and gives its points back as liberties to the neighbouring chains.
+
+        # Returns:
+        Tuple (root, stones, parents, liberties, hash) with what undo() needs to put the chain back.
+        '''
+        stones = self.stones.pop(root)
+        parents = [self.parent[stone] for stone in stones]
+        chain = (root, stones, parents, self.chain_liberties.pop(root), self.chain_hash.pop(root))
+        colour = int(self.flat[root])
+        self.hash ^= chain[4]
+        self.counts[colour] -= len(stones)
+        self.counts[Go.EMPTY] += len(stones)
+
+        for stone in stones:
+            self.flat[stone] = Go.EMPTY
+            self.parent[stone] = -1
+
+        for stone in stones:
+            for neighbour in self.neighbours[stone]:
+                if self.flat[neighbour] != Go.EMPTY:
+                    self.liberties(neighbour).add(stone)
+
+        return chain
+
+    def undo(self, move):
+        '''
+        # Description:
+        Takes back a move made with play() on this position, the last one first: puts the captured chains back,
+        splits the merged chains and removes the stone.
+        '''
+        point, player, _, _, changes = move
+        if changes is None:
+            return
+        previous_hash, merged, enemies, removed = changes
+
+        for root, stones, parents, liberties, chain_hash in reversed(removed):
+            for stone in stones:
+                for neighbour in self.neighbours[stone]:
+                    if self.flat[neighbour] != Go.EMPTY:
+                        self.liberties(neighbour).discard(stone)
+            for stone, parent in zip(stones, parents):
+                self.flat[stone] = -player
+                self.parent[stone] = parent
+            self.stones[root] = stones
+            self.chain_liberties[root] = liberties
+            self.chain_hash[root] = chain_hash
+            self.counts[-player] += len(stones)
+            self.counts[Go.EMPTY] -= len(stones)
+
+        for enemy in enemies:
+            self.chain_liberties[enemy].add(point)
+
+        if merged is None:
+            del self.stones[point]
+            del self.chain_liberties[point]
+            del self.chain_hash[point]
+        else:
+            root, length, liberties, chain_hash, absorbed = merged
+            del self.stones[root][length:]
+            self.chain_liberties[root] = liberties
+            self.chain_hash[root] = chain_hash
+            for friend, stones, friend_liberties, friend_hash in absorbed:
+                self.parent[friend] = friend
+                self.stones[friend] = stones
+                self.chain_liberties[friend] = friend_liberties
+                self.chain_hash[friend] = friend_hash
+
+        self.flat[point] = Go.EMPTY
+        self.parent[point] = -1
+        self.hash = previous_hash
+        self.counts[player] -= 1
+        self.counts[Go.EMPTY] += 1
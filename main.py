@@ -10,6 +10,7 @@ from Attaxx.attaxx import Attaxx
 from AlphaZero.alphaZero import ResNet
 from AlphaZero.alphaZero import AlphaZero
 from AlphaZero.alphaZero import MCTS
+from AlphaZero.alphaZero import EvaluationCache
 
 import os
 
@@ -50,7 +51,26 @@ if __name__ == '__main__':
             'num_iterations': 20,             # number of highest level iterations
             'num_selfPlay_iterations': 20,   # number of self-play games to play within each iteration
             'num_mcts_searches': 250,         # number of mcts simulations when selecting a move within self-play
+            'fast_mcts_searches': 50,         # number of mcts simulations of the moves of self-play that are not used for training
+            'full_search_prob': 0.25,         # fraction of the moves of self-play that get the full search and are used for training
+            'root_policy': 'puct',            # 'puct' for dirichlet noise and PUCT at the root of full searches, 'gumbel' for gumbel sequential halving
+            'gumbel_considered': 16,          # number of root actions sampled by the gumbel search
+            'leaf_batch_size': 8,             # number of leaves evaluated together by the network in each mcts step
+            'virtual_loss': 1,                # visits counted as lost on a leaf while it waits for the network
+            'reuse_tree': True,               # whether to keep the subtree of the played move for the next mcts search
+            'cache_size': 100000,             # number of network evaluations kept in the cache shared by the searches (0 disables it)
+            'opening_moves': 6,               # number of moves of self-play whose search trees are kept for the next games (0 disables it)
+            'opening_cache_size': 10000,      # number of opening positions kept
+            'opening_extra_searches': 25,     # minimum number of simulations added to a cached opening tree by each search
+            'num_workers': 1,                 # number of processes playing the self-play games of an iteration
+            'inference_server': False,        # whether the workers send their states to a single process running the network
+            'time_limit': 10,                 # maximum number of seconds for a move when playing against the model
+            'early_stop': True,               # whether to stop a search when playing against the model once its best move can't change
             'max_moves': 512,                 # maximum number of moves in a game (to avoid infinite games which should not happen but just in case)
+            'resign_threshold': -0.9,         # root value below which a player resigns in self-play, recalibrated after the played out games (None disables it)
+            'resign_moves': 3,                # number of consecutive moves below the threshold before resigning
+            'resign_playout_fraction': 0.1,   # fraction of the self-play games played out to the end to calibrate the threshold
+            'resign_false_positive_rate': 0.05, # target fraction of the played out games that would have been resigned by the winner
             'num_epochs': 400,                  # number of epochs for training on self-play data for each iteration
             'batch_size': 128,                # batch size for training
             'temperature': 1.50,              # temperature for the softmax selection of moves
@@ -73,7 +93,26 @@ if __name__ == '__main__':
             'num_iterations': 200,            # number of highest level iterations
             'num_selfPlay_iterations': 50,    # number of self-play games to play within each iteration
             'num_mcts_searches': 50,          # number of mcts simulations when selecting a move within self-play
+            'fast_mcts_searches': 10,         # number of mcts simulations of the moves of self-play that are not used for training
+            'full_search_prob': 0.25,         # fraction of the moves of self-play that get the full search and are used for training
+            'root_policy': 'gumbel',          # 'puct' for dirichlet noise and PUCT at the root of full searches, 'gumbel' for gumbel sequential halving
+            'gumbel_considered': 16,          # number of root actions sampled by the gumbel search
+            'leaf_batch_size': 4,             # number of leaves evaluated together by the network in each mcts step
+            'virtual_loss': 1,                # visits counted as lost on a leaf while it waits for the network
+            'reuse_tree': True,               # whether to keep the subtree of the played move for the next mcts search
+            'cache_size': 100000,             # number of network evaluations kept in the cache shared by the searches (0 disables it)
+            'opening_moves': 6,               # number of moves of self-play whose search trees are kept for the next games (0 disables it)
+            'opening_cache_size': 10000,      # number of opening positions kept
+            'opening_extra_searches': 25,     # minimum number of simulations added to a cached opening tree by each search
+            'num_workers': 1,                 # number of processes playing the self-play games of an iteration
+            'inference_server': False,        # whether the workers send their states to a single process running the network
+            'time_limit': 10,                 # maximum number of seconds for a move when playing against the model
+            'early_stop': True,               # whether to stop a search when playing against the model once its best move can't change
             'max_moves': 512,                 # maximum number of moves in a game (to avoid infinite games which should not happen but just in case)
+            'resign_threshold': -0.9,         # root value below which a player resigns in self-play, recalibrated after the played out games (None disables it)
+            'resign_moves': 3,                # number of consecutive moves below the threshold before resigning
+            'resign_playout_fraction': 0.1,   # fraction of the self-play games played out to the end to calibrate the threshold
+            'resign_false_positive_rate': 0.05, # target fraction of the played out games that would have been resigned by the winner
             'num_epochs': 200,                 # number of epochs for training on self-play data for each iteration
             'batch_size': 64,                 # batch size for training
             'temperature': 1.25,              # temperature for the softmax selection of moves
@@ -81,10 +120,13 @@ if __name__ == '__main__':
             'augment': False,                 # whether to augment the training data with flipped states
             'dirichlet_alpha': 0.5,           # the value of the dirichlet noise
             'dirichlet_epsilon': 0.125,       # the value of the dirichlet noise
+            'compact_actions': size > 4,      # whether to encode moves as (from square, offset) instead of (from square, to square), both have the same size on 4x4
+            'solver_empties': 4,              # number of empty squares from which the mcts solves the positions exactly instead of asking the network (0 disables it)
+            'solver_max_nodes': 2000,         # maximum number of positions searched by the solver before giving up on a position
             'alias': ('Attaxx' + SAVE_NAME)
         }
 
-        game = Attaxx(game_size)
+        game = Attaxx(game_size, args['compact_actions'])
         model = ResNet(game, 20, 48, device)
         optimizer = Adam(model.parameters(), lr=0.001, weight_decay=0.0001)
 
@@ -106,9 +148,34 @@ if __name__ == '__main__':
 
         print(f"Skip Chance: {array[-1]}")
 
+    def input_attaxx_move(game, state, player):
+
+        # A player with no valid moves passes
+        if not game.check_available_moves(state, player):
+            print("\nNo valid moves, passing\n")
+            return game.action_size - 1
+
+        # Asking again until the move is a valid one
+        while True:
+            try:
+                move = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
+            except ValueError:
+                move = ()
+            action = game.get_move_action(state, move, player)
+            if action is not None:
+                print("\n")
+                return action
+            print("Invalid move, the move is given as: row column new_row new_column")
+
     if LOAD:
-        model.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt', map_location=device))
-        optimizer.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{OPT}.pt', map_location=device))
+        state_dict = torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt', map_location=device)
+        if GAME == 'Attaxx' and game.compact_actions and state_dict['policyHead.4.bias'].shape[0] != game.action_size:
+            # model trained with the full (from, to) encoding
+            model.load_state_dict(ResNet.convert_policy_head(state_dict, game.get_full_actions()))
+            print("Converted the model to compact actions, the optimizer starts from scratch")
+        else:
+            model.load_state_dict(state_dict)
+            optimizer.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{OPT}.pt', map_location=device))
 
     if not TEST:
         os.makedirs(f'AlphaZero/Models/{GAME+SAVE_NAME}', exist_ok=True)
@@ -127,8 +194,10 @@ if __name__ == '__main__':
             game = Go()
 
             model.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt'))
-            mcts = MCTS(model, game, args)
+            mcts = MCTS(model, game, args, EvaluationCache(game, args, args['cache_size']))
             state = game.get_initial_state()
+            history = {game.get_hash(state)}
+            position = game.get_position(state)
             game.print_board(state)
 
             player = 1
@@ -139,43 +208,48 @@ if __name__ == '__main__':
                         a, b = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
                         print("\n")
                         action = a * 9 + b
-                        state = game.get_next_state(state, action, player)
+                        state = game.get_next_state(state, action, player, history, position)
                     else:
-                        tmp_state = game.change_perspective(state, -1)
-                        action = mcts.search(tmp_state, -player)                    
+                        # the stats add up over the searches, only the ones of this search are printed
+                        stats = dict(mcts.stats)
+                        action = mcts.search(state, player, history, args['time_limit'], args['early_stop'])                    
                         print_array_as_grid_corrected(action)
                         action = np.argmax(action)
 
                         print(f"\nAlphaZero Action: {action // game.row_count} {action % game.column_count}\n")
-                        state = game.get_next_state(state, action, player)
+                        print(f"Simulations: {mcts.stats['searches'] - stats['searches']} run, {mcts.stats['saved_searches'] - stats['saved_searches']} saved by the early stop")
+                        state = game.get_next_state(state, action, player, history, position)
                 else:
                     if PLAYER2 == 'user':
                         a, b = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
                         print("\n")
                         action = a * 9 + b
-                        state = game.get_next_state(state, action, player)
+                        state = game.get_next_state(state, action, player, history, position)
                     else:
-                        action = mcts.search(state, player)                    
+                        # the stats add up over the searches, only the ones of this search are printed
+                        stats = dict(mcts.stats)
+                        action = mcts.search(state, player, history, args['time_limit'], args['early_stop'])                    
                         print_array_as_grid_corrected(action)
                         action = np.argmax(action)
 
                         print(f"\nAlphaZero Action: {action // game.row_count} {action % game.column_count}\n")
-                        state = game.get_next_state(state, action, player)
+                        print(f"Simulations: {mcts.stats['searches'] - stats['searches']} run, {mcts.stats['saved_searches'] - stats['saved_searches']} saved by the early stop")
+                        state = game.get_next_state(state, action, player, history, position)
 
                 winner, win = game.get_value_and_terminated(state, action, player)
                 if win:
                     game.print_board(state)
-                    print(f"player {winner} wins")
+                    print(f"player {winner * player} wins" if winner != 0 else "draw")
                     exit()
 
+                mcts.advance(action)
                 player = - player
                 game.print_board(state)
             
         elif GAME == 'Attaxx':
-            game = Attaxx(game_size)
+            game = Attaxx(game_size, args['compact_actions'])
 
-            model.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt', map_location=device))
-            mcts = MCTS(model, game, args)
+            mcts = MCTS(model, game, args, EvaluationCache(game, args, args['cache_size']))
             state = game.get_initial_state()
             game.print_board(state)
 
@@ -184,33 +258,35 @@ if __name__ == '__main__':
             while True:
                 if player == 1:
                     if PLAYER1 == 'user':
-                        move = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
-                        print("\n")
-                        action = game.move_to_int(move)
+                        action = input_attaxx_move(game, state, player)
                         state = game.get_next_state(state, action, player)
                     else:
-                        tmp_state = game.change_perspective(state, -1)
-                        action = mcts.search(tmp_state, -player)
+                        # the stats add up over the searches, only the ones of this search are printed
+                        stats = dict(mcts.stats)
+                        action = mcts.search(state, player, time_limit=args['time_limit'], early_stop=args['early_stop'])
                         action = np.argmax(action)
                         print(f"\nAlphaZero Action: {game.int_to_move(action)}\n")
+                        print(f"Simulations: {mcts.stats['searches'] - stats['searches']} run, {mcts.stats['saved_searches'] - stats['saved_searches']} saved by the early stop")
                         state = game.get_next_state(state, action, player)
                 else:
                     if PLAYER2 == 'user':
-                        move = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
-                        print("\n")
-                        action = game.move_to_int(move)
+                        action = input_attaxx_move(game, state, player)
                         state = game.get_next_state(state, action, player)
                     else:
-                        action = mcts.search(state, player)
+                        # the stats add up over the searches, only the ones of this search are printed
+                        stats = dict(mcts.stats)
+                        action = mcts.search(state, player, time_limit=args['time_limit'], early_stop=args['early_stop'])
                         action = np.argmax(action)
                         print(f"\nAlphaZero Action: {game.int_to_move(action)}\n")
+                        print(f"Simulations: {mcts.stats['searches'] - stats['searches']} run, {mcts.stats['saved_searches'] - stats['saved_searches']} saved by the early stop")
                         state = game.get_next_state(state, action, player)
 
                 winner, win = game.get_value_and_terminated(state, action, player)
                 if win:
                     game.print_board(state)
-                    print(f"player {winner} wins")
+                    print(f"player {winner * player} wins" if winner != 0 else "draw")
                     exit()
 
+                mcts.advance(action)
                 player = -player
                 game.print_board(state)
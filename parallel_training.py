@@ -9,6 +9,7 @@ from Attaxx.attaxx import Attaxx
 from AlphaZero.alphazero_parallel import AlphaZeroParallel
 from AlphaZero.alphazero_parallel import MCTSParallel
 from AlphaZero.alphazero_parallel import ResNetParallel
+from AlphaZero.alphaZero import MCTS
 
 import os
 
@@ -50,6 +51,7 @@ if __name__ == '__main__':
             'num_selfPlay_iterations': 10,   # number of self-play games to play within each iteration
             'num_parallel_games': 100,        # number games played in parallel  
             'num_mcts_searches': 100,         # number of mcts simulations when selecting a move within self-play
+            'max_moves': 512,                 # maximum number of moves in a game
             'num_epochs': 200,                  # number of epochs for training on self-play data for each iteration
             'batch_size': 8,                # batch size for training
             'temperature': 1.25,              # temperature for the softmax selection of moves
@@ -65,12 +67,14 @@ if __name__ == '__main__':
         optimizer = Adam(model.parameters(), lr=0.001, weight_decay=0.0001)
 
     elif GAME == 'Attaxx':
-         args = {
+        size = int(input("Game size: (4/5/6) "))
+        args = {
             'game': 'Attaxx',
             'num_iterations': 8,              # number of highest level iterations
             'num_selfPlay_iterations': 400,   # number of self-play games to play within each iteration
             'num_parallel_games': 100,        # number games played in parallel  
             'num_mcts_searches': 60,          # number of mcts simulations when selecting a move within self-play
+            'max_moves': 512,                 # maximum number of moves in a game
             'num_epochs': 4,                  # number of epochs for training on self-play data for each iteration
             'batch_size': 40,                 # batch size for training
             'temperature': 1.25,              # temperature for the softmax selection of moves
@@ -78,12 +82,13 @@ if __name__ == '__main__':
             'augment': False,                 # whether to augment the training data with flipped states
             'dirichlet_alpha': 0.3,           # the value of the dirichlet noise
             'dirichlet_epsilon': 0.125,       # the value of the dirichlet noise
+            'compact_actions': size > 4,      # whether to encode moves as (from square, offset) instead of (from square, to square)
             'alias': ('Attaxx' + SAVE_NAME)
         }
 
-        # game = Attaxx()
-        # model = ResNet(game, 9, 128, device)
-        # optimizer = Adam(model.parameters(), lr=0.001, weight_decay=0.0001)
+        game = Attaxx([size, size], args['compact_actions'])
+        model = ResNetParallel(game, 9, 128, device)
+        optimizer = Adam(model.parameters(), lr=0.001, weight_decay=0.0001)
 
     if LOAD:
         model.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt', map_location=device))
@@ -98,11 +103,10 @@ if __name__ == '__main__':
             print("No model to test")
             exit()
         if GAME == 'Go':
-            game = Go()
-
-            model.load_state_dict(torch.load(f'AlphaZero/Models/{GAME+SAVE_NAME}/{MODEL}.pt'))
-            mcts = MCTSParallel(model, game, args)
+            mcts = MCTS(model, game, args)
             state = game.get_initial_state()
+            history = {game.get_hash(state)}
+            position = game.get_position(state)
             game.print_board(state)
 
             player = 1
@@ -112,32 +116,24 @@ if __name__ == '__main__':
                     a, b = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
                     print("\n")
                     action = a * 9 + b
-                    state = game.get_next_state(state, action, player)
+                    state = game.get_next_state(state, action, player, history, position)
                 else:
-                    neut = game.change_perspective(state, player)
-                    action = mcts.search(neut, player)
+                    action = mcts.search(state, player, history)
                     action = np.argmax(action)
                     print(f"\nAlphaZero Action: {action}\n")
-                    state = game.get_next_state(state, action, player)
+                    state = game.get_next_state(state, action, player, history, position)
 
-                winner, win = game.get_value_and_terminated(state, action)
+                winner, win = game.get_value_and_terminated(state, action, player)
                 if win:
                     game.print_board(state)
-                    print(f"player {winner} wins")
+                    print(f"player {winner * player} wins" if winner != 0 else "draw")
                     exit()
 
                 player = - player
                 game.print_board(state)
             
         elif GAME == 'Attaxx':
-            
-            BOARD_SIZE = int(input("Input Attaxx Board Size: "))
-            game = Attaxx([BOARD_SIZE, BOARD_SIZE])
-            name = input("Model File Name: ")
-
-            model.load_state_dict(torch.load('AlphaZero/Models/Attaxx/' + name + '.pt'))
-
-            mcts = MCTSParallel(model, game, args)
+            mcts = MCTS(model, game, args)
             state = game.get_initial_state()
             game.print_board(state)
 
@@ -145,22 +141,28 @@ if __name__ == '__main__':
 
             while True:
                 if player == 1:
-
+                    action = None if game.check_available_moves(state, player) else game.action_size - 1
+                    while action is None:
+                        try:
+                            move = tuple(int(x.strip()) for x in input("\nInput your move: ").split(' '))
+                        except ValueError:
+                            move = ()
+                        action = game.get_move_action(state, move, player)
+                        if action is None:
+                            print("Invalid move, the move is given as: row column new_row new_column")
+                    print("\n")
                     state = game.get_next_state(state, action, player)
                 else:
-                    neut = game.change_perspective(state, player)
-
-                    action = mcts.search(neut, player)
-
+                    action = mcts.search(state, player)
                     action = np.argmax(action)
-
+                    print(f"\nAlphaZero Action: {game.int_to_move(action)}\n")
                     state = game.get_next_state(state, action, player)
 
-                winner, win = game.get_value_and_terminated(state, action)
+                winner, win = game.get_value_and_terminated(state, action, player)
                 if win:
                     game.print_board(state)
-                    print(f"player {winner} wins")
+                    print(f"player {winner * player} wins" if winner != 0 else "draw")
                     exit()
 
                 player = - player
-                game.print_board(state)
\ No newline at end of file
+                game.print_board(state)